@@ -0,0 +1,376 @@
+"""
+Нагрузочный тест живого конвейера без сети и камеры.
+
+Синтетический издатель (lavfi testsrc) передает видео через WebRTCClient в WebRTCServer,
+после чего N headless-зрителей подключаются к WebServer через /offer.
+Издатель, сервер и зрители работают в отдельных процессах, поэтому процессорное время
+и память измеряются для каждого этапа отдельно. Время "от камеры до экрана" измеряется
+по метке времени, которая рисуется в верхней строке каждого кадра.
+
+Запуск из корня репозитория:
+    python -m benchmarks.live_pipeline -n 10 -d 30 -o report.json
+"""
+import aiohttp
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import websockets
+
+from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import MediaStreamError
+from argparse import ArgumentParser
+from av import VideoFrame
+from general_classes.signaling import WebSocketBasic
+
+STAMP_BITS = 32
+STAMP_MASK = (1 << STAMP_BITS) - 1
+
+
+def now_ms():
+    return int(time.time() * 1000) & STAMP_MASK
+
+
+# размер блока одного бита метки
+def stamp_block(width):
+    return max(2, min(16, width // STAMP_BITS))
+
+
+# Дорожка, рисующая в верхней строке кадра текущее время в миллисекундах (32 черно-белых блока)
+class StampedTrack(MediaStreamTrack):
+    kind = "video"
+
+    def __init__(self, track):
+        super().__init__()
+        self.track = track
+
+    async def recv(self):
+        frame = await self.track.recv()
+        image = frame.to_ndarray(format="yuv420p")
+        block = stamp_block(frame.width)
+        stamp = now_ms()
+        for bit in range(STAMP_BITS):
+            value = 235 if stamp >> (STAMP_BITS - 1 - bit) & 1 else 16
+            image[0:block, bit * block:(bit + 1) * block] = value
+        stamped = VideoFrame.from_ndarray(image, format="yuv420p")
+        stamped.pts = frame.pts
+        stamped.time_base = frame.time_base
+        return stamped
+
+
+def read_stamp(frame):
+    image = frame.to_ndarray(format="yuv420p")
+    block = stamp_block(frame.width)
+    margin = block // 4
+    stamp = 0
+    for bit in range(STAMP_BITS):
+        cell = image[margin:block - margin, bit * block + margin:(bit + 1) * block - margin]
+        stamp = stamp << 1 | int(cell.mean() > 125)
+    return stamp
+
+
+# Сигнальный канал без TLS и авторизации для локального подключения к WebSocketServer
+class LocalWebSocketClient(WebSocketBasic):
+    def __init__(self, server, port):
+        super().__init__()
+        asyncio.get_event_loop().create_task(self.__connect(f"ws://{server}:{port}"))
+
+    async def __connect(self, uri):
+        async with websockets.connect(uri) as self._websock:
+            if self._on_connected:
+                await self._on_connected(self._websock)
+            async for message in self._websock:
+                data = json.loads(message)
+                if self._on_message:
+                    await self._on_message(data)
+
+
+# Headless-зритель: подключается к /offer и считает кадры и задержку
+class Viewer:
+    def __init__(self, number):
+        self.number = number
+        self.pc = RTCPeerConnection()
+        self.join_time = None
+        self.frames = 0
+        self.latencies = []
+        self.__measure = False
+        self.__task = None
+
+    async def connect(self, session, url):
+        started = time.time()
+        self.pc.addTransceiver("video", direction="recvonly")
+
+        @self.pc.on("track")
+        def on_track(track):
+            self.__task = asyncio.ensure_future(self.__consume(track, started))
+
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        offer = {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type}
+        async with session.post(url, json=offer) as response:
+            response.raise_for_status()
+            answer = await response.json()
+        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+
+    def measure(self, enabled):
+        self.__measure = enabled
+
+    async def __consume(self, track, started):
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                return
+            if self.join_time is None:
+                self.join_time = time.time() - started
+            if self.__measure:
+                self.frames += 1
+                self.latencies.append((now_ms() - read_stamp(frame)) & STAMP_MASK)
+
+    async def close(self):
+        if self.__task:
+            self.__task.cancel()
+        await self.pc.close()
+
+    def report(self, duration):
+        # кадры с неверно прочитанной меткой (артефакты кодирования) отбрасываются
+        latencies = sorted(x for x in self.latencies if x < 60000)
+        return {
+            "viewer": self.number,
+            "join_time_ms": round(self.join_time * 1000, 1) if self.join_time is not None else None,
+            "frames": self.frames,
+            "fps": round(self.frames / duration, 2),
+            "latency_ms": summarize(latencies),
+        }
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "mean": round(statistics.mean(values), 1),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+# процессорное время и пиковая память текущего процесса
+def usage(started):
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    wall = time.time() - started
+    cpu = rusage.ru_utime + rusage.ru_stime
+    return {
+        "cpu_seconds": round(cpu, 2),
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "max_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+    }
+
+
+# ожидание, пока локальный порт начнет принимать подключения
+async def wait_listening(port, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def run_server(args, listening, ready, stop, results):
+    from server import WebRTCServer
+    from web_server.webserver import WebServer
+
+    started = time.time()
+    # записи сервера сохраняются во временный каталог
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(os.path.join(workdir, "video"))
+    os.chdir(workdir)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    conn = WebRTCServer()
+    web_server = WebServer(conn.video_track, port=args.http_port)
+
+    async def serve():
+        await web_server.start_webserver()
+        await conn.accept(args.signaling_port, "00:30:00")
+        # издатель запускается только после открытия сигнального порта
+        await wait_listening(args.signaling_port)
+        listening.set()
+        while await conn.video_track() is None:
+            await asyncio.sleep(0.1)
+        ready.set()
+        await loop.run_in_executor(None, stop.wait)
+
+    try:
+        loop.run_until_complete(serve())
+    finally:
+        loop.run_until_complete(asyncio.gather(conn.close_connection(), web_server.stop_webserver()))
+    report = usage(started)
+    report["recorder"] = conn.recorder.writer.stats()
+    results.put(("server", report))
+
+
+def run_publisher(args, stop, results):
+    from client import WebRTCClient
+
+    started = time.time()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    source = MediaPlayer(f"testsrc=size={args.resolution}:rate={args.fps}", format="lavfi").video
+    conn = WebRTCClient(track=StampedTrack(source))
+
+    async def publish():
+        await conn.connect("127.0.0.1", args.signaling_port, signaling_class=LocalWebSocketClient)
+        await loop.run_in_executor(None, stop.wait)
+
+    try:
+        loop.run_until_complete(publish())
+    finally:
+        loop.run_until_complete(conn.close_connection())
+    results.put(("publisher", usage(started)))
+
+
+def run_viewers(args, results):
+    started = time.time()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def watch():
+        base = f"http://127.0.0.1:{args.http_port}"
+        viewers = [Viewer(i) for i in range(args.viewers)]
+        # cookie сессии выдается для IP-адреса, поэтому нужен unsafe cookie jar
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+            async with session.post(f"{base}/login", allow_redirects=False,
+                                    data={"username": args.user, "password": args.password}) as response:
+                if response.status != 302:
+                    raise RuntimeError(f"Login failed: HTTP {response.status}")
+            await asyncio.gather(*[viewer.connect(session, f"{base}/offer") for viewer in viewers])
+        await asyncio.sleep(args.warmup)
+        for viewer in viewers:
+            viewer.measure(True)
+        await asyncio.sleep(args.duration)
+        for viewer in viewers:
+            viewer.measure(False)
+        await asyncio.gather(*[viewer.close() for viewer in viewers])
+        return [viewer.report(args.duration) for viewer in viewers]
+
+    reports = loop.run_until_complete(watch())
+    results.put(("viewers", usage(started)))
+    results.put(("viewer_reports", reports))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def package_version(name):
+    try:
+        return __import__(name).__version__
+    except (ImportError, AttributeError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description="Headless load test of the live pipeline")
+    parser.add_argument("-n", "--viewers", type=int, default=5, help="Number of viewers (default: 5)")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="Measurement time, s (default: 20)")
+    parser.add_argument("-w", "--warmup", type=float, default=5, help="Warm-up time, s (default: 5)")
+    parser.add_argument("-r", "--resolution", default="640x480", help="Test video resolution")
+    parser.add_argument("-f", "--fps", type=int, default=30, help="Test video frame rate")
+    parser.add_argument("--signaling-port", type=int, default=8765, help="Local signaling port")
+    parser.add_argument("--http-port", type=int, default=8081, help="Local web server port")
+    parser.add_argument("--user", default="vadim", help="User with realtime_video permission")
+    parser.add_argument("--password", default="qwerty", help="Password of the user")
+    parser.add_argument("-o", "--output", help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    listening = context.Event()
+    ready = context.Event()
+    stop = context.Event()
+    results = context.Queue()
+
+    server = context.Process(target=run_server, args=(args, listening, ready, stop, results))
+    publisher = context.Process(target=run_publisher, args=(args, stop, results))
+    server.start()
+    try:
+        if not listening.wait(timeout=60):
+            raise RuntimeError("The server did not open the signaling port in 60 s")
+        publisher.start()
+        if not ready.wait(timeout=60):
+            raise RuntimeError("The publisher did not reach the server in 60 s")
+        viewers = context.Process(target=run_viewers, args=(args, results))
+        viewers.start()
+        viewers.join()
+    finally:
+        stop.set()
+        if publisher.is_alive():
+            publisher.join(timeout=30)
+        server.join(timeout=30)
+
+    collected = {}
+    while True:
+        try:
+            name, value = results.get(timeout=1)
+        except queue.Empty:
+            break
+        collected[name] = value
+    viewer_reports = collected.pop("viewer_reports", [])
+    latencies = sorted(v["latency_ms"]["p50"] for v in viewer_reports if v["latency_ms"])
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+            "aiortc": package_version("aiortc"),
+            "av": package_version("av"),
+        },
+        "config": {
+            "viewers": args.viewers,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "resolution": args.resolution,
+            "fps": args.fps,
+        },
+        "summary": {
+            "connected_viewers": sum(1 for v in viewer_reports if v["frames"]),
+            "mean_fps": round(statistics.mean(v["fps"] for v in viewer_reports), 2) if viewer_reports else None,
+            "min_fps": min((v["fps"] for v in viewer_reports), default=None),
+            "median_latency_ms": latencies[len(latencies) // 2] if latencies else None,
+        },
+        "stages": collected,
+        "viewers": viewer_reports,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(0 if report["summary"]["connected_viewers"] == args.viewers else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Нагрузочный тест авторизации веб-сервера без камеры.
+
+WebServer запускается в отдельном процессе без видео, клиент с заданным числом параллельных
+запросов по очереди нагружает страницу / , запрос /offer (с заранее сформированным offer)
+и вход /login. Для каждого сценария измеряется число запросов в секунду, задержки и коды ответов,
+а также задержка ответа на легкий запрос /logo.svg, выполняемый параллельно с нагрузкой:
+рост этой задержки во время входа пользователей означает, что проверка паролей блокирует сервер.
+
+Запуск из корня репозитория:
+    python -m benchmarks.web_auth -c 20 -d 10 -o report.json
+"""
+import aiohttp
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import tempfile
+import time
+
+from aiortc import RTCPeerConnection
+from argparse import ArgumentParser
+from benchmarks.live_pipeline import summarize, usage, git_commit, package_version
+
+SCENARIOS = ("index", "offer", "login")
+
+
+def run_server(args, ready, stop, results):
+    from web_server.webserver import WebServer
+
+    started = time.time()
+    # страница / показывает файлы из папки video
+    os.makedirs(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "video"), exist_ok=True)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def no_video():
+        return None
+
+    session_key = os.path.join(tempfile.mkdtemp(prefix="bench_"), "session.key")
+    web_server = WebServer(no_video, port=args.http_port, pc_pool_size=args.pc_pool, session_key=session_key)
+
+    async def serve():
+        await web_server.start_webserver()
+        ready.set()
+        await loop.run_in_executor(None, stop.wait)
+
+    try:
+        loop.run_until_complete(serve())
+    finally:
+        loop.run_until_complete(web_server.stop_webserver())
+    results.put(("server", usage(started)))
+
+
+# offer, который повторно отправляется во всех запросах /offer
+async def make_offer():
+    pc = RTCPeerConnection()
+    pc.addTransceiver("video", direction="recvonly")
+    await pc.setLocalDescription(await pc.createOffer())
+    offer = {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+    await pc.close()
+    return offer
+
+
+async def login(session, base, args):
+    async with session.post(f"{base}/login", allow_redirects=False,
+                            data={"username": args.user, "password": args.password}) as response:
+        return response.status
+
+
+# один сценарий: concurrency клиентов отправляют запросы в течение duration секунд
+async def run_scenario(name, session, base, args, offer):
+    statuses = {}
+    latencies = []
+    probes = []
+    deadline = time.time() + args.duration
+
+    async def request():
+        if name == "index":
+            async with session.get(f"{base}/", allow_redirects=False) as response:
+                await response.read()
+                return response.status
+        if name == "offer":
+            async with session.post(f"{base}/offer", json=offer) as response:
+                await response.read()
+                return response.status
+        return await login(session, base, args)
+
+    async def worker():
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                status = str(await request())
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies.append(1000 * (time.perf_counter() - started))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def probe():
+        while time.time() < deadline:
+            started = time.perf_counter()
+            async with session.get(f"{base}/logo.svg") as response:
+                await response.read()
+            probes.append(1000 * (time.perf_counter() - started))
+            await asyncio.sleep(0.05)
+
+    started = time.time()
+    await asyncio.gather(probe(), *[worker() for _ in range(args.concurrency)])
+    elapsed = time.time() - started
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "statuses": statuses,
+        "latency_ms": summarize(sorted(round(x, 1) for x in latencies)),
+        "probe_latency_ms": summarize(sorted(round(x, 1) for x in probes)),
+    }
+
+
+async def run_client(args):
+    base = f"http://127.0.0.1:{args.http_port}"
+    offer = await make_offer()
+    connector = aiohttp.TCPConnector(limit=args.concurrency + 1)
+    # cookie сессии выдается для IP-адреса, поэтому нужен unsafe cookie jar
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        status = await login(session, base, args)
+        if status != 302:
+            raise RuntimeError(f"Login failed: HTTP {status}")
+        reports = {}
+        for name in args.scenarios:
+            reports[name] = await run_scenario(name, session, base, args, offer)
+        return reports
+
+
+def main():
+    parser = ArgumentParser(description="Load test of web server authorization")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="Parallel requests (default: 10)")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Time of each scenario, s (default: 10)")
+    parser.add_argument("-s", "--scenario", dest="scenarios", action="append", choices=SCENARIOS,
+                        help="Scenario to run (default: all)")
+    parser.add_argument("--pc-pool", type=int, default=2, help="Peer connection pool size of the server")
+    parser.add_argument("--http-port", type=int, default=8082, help="Local web server port")
+    parser.add_argument("--user", default="vadim", help="User with realtime_video permission")
+    parser.add_argument("--password", default="qwerty", help="Password of the user")
+    parser.add_argument("-o", "--output", help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    stop = context.Event()
+    results = context.Queue()
+
+    server = context.Process(target=run_server, args=(args, ready, stop, results))
+    server.start()
+    try:
+        if not ready.wait(timeout=60):
+            raise RuntimeError("The web server did not start in 60 s")
+        scenarios = asyncio.get_event_loop().run_until_complete(run_client(args))
+    finally:
+        stop.set()
+        server.join(timeout=30)
+
+    collected = {}
+    while True:
+        try:
+            name, value = results.get(timeout=1)
+        except queue.Empty:
+            break
+        collected[name] = value
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+            "aiohttp": package_version("aiohttp"),
+            "aiortc": package_version("aiortc"),
+        },
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "pc_pool": args.pc_pool,
+        },
+        "scenarios": scenarios,
+        "stages": collected,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(text + "\n")
+    else:
+        print(text)
+    failed = any(not s["statuses"] or set(s["statuses"]) - {"200", "302"} for s in scenarios.values())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,45 @@
 import asyncio
 import configparser
+import inspect
 import logging
 import platform
 import ssl
 import sys
 
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, RTCRtpSender
 from aiortc.contrib.media import MediaPlayer, MediaRelay
 from argparse import ArgumentParser
-from general_classes.logging_setting import ColorHandler
+from general_classes.capture import LatestFrameTrack
+from general_classes.logging_setting import LogHandler, LOG_FORMATS, pipeline
 from general_classes.signaling import WebSocketClient
 
 
+logger = logging.getLogger("webrtc")
+
+
 # Класс для создания webRTC подключения
+# track - внешний источник видео (например, принятая сервером дорожка для ретрансляции),
+# если не задан, то видео берется с камеры
+# input_format - формат, запрашиваемый у камеры (h264, mjpeg); для h264 кадры передаются
+# без перекодирования, если MediaPlayer поддерживает режим без декодирования
 class WebRTCClient:
-    def __init__(self, resolution="640x480", bitrate=None):
+    def __init__(self, resolution="640x480", bitrate=None, track=None, fps=30, input_format=None):
         self.pc = None
         self.signaling = None
-        self.__video = None
+        self.__video = track
+        self.__relay = MediaRelay()
+        self.__capture = None
+        self.__camera = track is None
         self.resolution = resolution
         self.bitrate = bitrate
-
-    async def connect(self, host, port, turn=None):
+        self.fps = fps
+        self.input_format = input_format
+        self.passthrough = (
+            self.__camera and input_format == "h264" and "decode" in inspect.signature(MediaPlayer).parameters
+        )
+
+    # signaling_class - класс сигнального канала, создаваемый как signaling_class(host, port)
+    async def connect(self, host, port, turn=None, signaling_class=WebSocketClient):
         ice_servers = [RTCIceServer('stun:stun.l.google.com:19302')]
         if turn:
             ice_servers.append(turn)
@@ -30,12 +48,21 @@ class WebRTCClient:
 
         if not self.__video:
             self.__video = await self.__get_tracks()
-        self.pc.addTrack(MediaRelay().subscribe(self.__video))
+        # буфер на один кадр стоит после MediaRelay, чтобы кадры не копились в очереди его подписчика,
+        # если кодировщик не успевает; частота выдачи ограничивается только для камеры
+        self.__capture = LatestFrameTrack(self.__relay.subscribe(self.__video), self.fps if self.__camera else None)
+        sender = self.pc.addTrack(self.__capture)
+        if self.passthrough:
+            # пакеты камеры передаются как есть, поэтому согласуется только H.264
+            transceiver = next(t for t in self.pc.getTransceivers() if t.sender == sender)
+            transceiver.setCodecPreferences([
+                codec for codec in RTCRtpSender.getCapabilities("video").codecs if codec.mimeType == "video/H264"
+            ])
 
         offer = await self.pc.createOffer()
         await self.pc.setLocalDescription(offer)
 
-        self.signaling = WebSocketClient(host, port)
+        self.signaling = signaling_class(host, port)
 
         async def send_offer():
             logger.debug(f"Ice Gathering State: {self.pc.iceGatheringState}")
@@ -65,24 +92,32 @@ class WebRTCClient:
             logger.info(f"Connection state: {self.pc.connectionState}")
 
     async def __get_tracks(self):
+        video_options = {"video_size": self.resolution, "framerate": str(self.fps)}
         if self.bitrate:
-            video_options = {"video_size": self.resolution, "framerate": "30", "b:v": self.bitrate}
-        else:
-            video_options = {"video_size": self.resolution, "framerate": "30"}
+            video_options["b:v"] = self.bitrate
+        player_options = {"decode": False} if self.passthrough else {}
 
         if platform.system() == "Windows":
+            if self.input_format:
+                video_options["vcodec"] = self.input_format
             video_track = MediaPlayer(
                 "video=HP TrueVision HD Camera",
                 format="dshow",
-                options=video_options
+                options=video_options,
+                **player_options
             ).video
         else:
-            video_track = MediaPlayer("/dev/video0", format="v4l2", options=video_options).video
+            if self.input_format:
+                video_options["input_format"] = self.input_format
+            video_track = MediaPlayer("/dev/video0", format="v4l2", options=video_options, **player_options).video
 
         return video_track
 
     async def close_connection(self):
         if self.pc and self.__video and self.signaling:
+            if self.__capture:
+                logger.info(f"Capture: {self.__capture.delivered} frames delivered, {self.__capture.dropped} dropped")
+                self.__capture.stop()
             self.__video.stop()
             await self.pc.close()
             await self.signaling.close()
@@ -90,7 +125,7 @@ class WebRTCClient:
     async def video_track(self):
         if not self.__video:
             self.__video = await self.__get_tracks()
-        return MediaRelay().subscribe(self.__video)
+        return self.__relay.subscribe(self.__video)
 
 
 # режим создания файла концфигурации server.ini
@@ -126,9 +161,14 @@ def main():
     parser.add_argument("-s", "--server", help='Server IP address')
     parser.add_argument("-p", "--port", type=int, help='Server port')
     parser.add_argument("-v", "--verbose", action="count", help='Enable debug log')
+    parser.add_argument("--log-format", choices=LOG_FORMATS, help="Log output format (default: color)")
+    parser.add_argument("--log-file", help="Write log to the file instead of the terminal")
     parser.add_argument("-c", "--configuration", action="count", help="Create config file")
     parser.add_argument("-r", "--resolution", help="Set cam resolution")
     parser.add_argument("-b", "--bitrate", help="Set cam bitrate")
+    parser.add_argument("-f", "--fps", type=int, help="Set target frame rate (default: 30)")
+    parser.add_argument("--input-format", choices=["h264", "mjpeg"],
+                        help="Request compressed video from the cam (h264 is sent without re-encoding if supported)")
     parser.add_argument("--cert-file", help="SSL certificate file (for HTTPS)")
     parser.add_argument("--key-file", help="SSL key file (for HTTPS)")
     args = parser.parse_args()
@@ -154,10 +194,19 @@ def main():
         args.port = config.get("CONNECTION", "socket_port")
     if args.verbose or config.get("LOG", "enable_debug", fallback="false").lower() == "true":
         logger.setLevel(logging.DEBUG)
+    if not args.log_format:
+        args.log_format = config.get("LOG", "format", fallback="color")
+    if not args.log_file:
+        args.log_file = config.get("LOG", "file", fallback=None)
+    pipeline.configure(args.log_format, args.log_file)
     if not args.resolution:
         args.resolution = config.get("CAM", "resolution", fallback="640x480")
     if not args.bitrate:
         args.bitrate = config.get("CAM", "bitrate", fallback=None)
+    if not args.fps:
+        args.fps = config.getint("CAM", "fps", fallback=30)
+    if not args.input_format:
+        args.input_format = config.get("CAM", "input_format", fallback=None)
 
     turn_server = None
     if config.has_option("TURN", "url"):
@@ -176,7 +225,9 @@ def main():
         ssl_context = None
 
     # Создание соединения
-    conn = WebRTCClient(args.resolution, args.bitrate)
+    conn = WebRTCClient(args.resolution, args.bitrate, fps=args.fps, input_format=args.input_format)
+    if args.input_format == "h264" and not conn.passthrough:
+        logger.warning("MediaPlayer can't pass H.264 through: the cam video will be decoded and re-encoded")
 
     try:
         # запуск всех задач
@@ -190,7 +241,6 @@ def main():
 
 
 if __name__ == '__main__':
-    logger = logging.getLogger("webrtc")
     logger.setLevel(logging.INFO)
-    logger.addHandler(ColorHandler())
+    logger.addHandler(LogHandler())
     main()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from av import Packet
+from general_classes.logging_setting import LogHandler
+
+
+# настройка логов
+logger = logging.getLogger("capture")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+
+# Дорожка захвата, которая всегда отдает самый новый кадр.
+# Кадры забираются из источника сразу по мере поступления и хранятся в буфере на один кадр:
+# если кодировщик не успевает, старый кадр заменяется новым (и учитывается как отброшенный),
+# поэтому очереди перед ним (MediaPlayer, MediaRelay) не растут и задержка остается ограниченной.
+# fps - целевая частота выдачи кадров; если не задана, кадры отдаются по мере поступления.
+# Если источник отдает закодированные пакеты (режим без декодирования), то после отброшенного
+# пакета выдача возобновляется только с ключевого кадра.
+class LatestFrameTrack(MediaStreamTrack):
+    kind = "video"
+
+    def __init__(self, track, fps=None):
+        super().__init__()
+        self.track = track
+        self.fps = fps
+        self.delivered = 0
+        self.dropped = 0
+        self.__frame = None
+        self.__wait_keyframe = False
+        self.__ended = False
+        self.__event = asyncio.Event()
+        self.__task = None
+        self.__next_time = None
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.__read())
+
+        await self.__pace()
+        while self.__frame is None:
+            if self.__ended:
+                self.stop()
+                raise MediaStreamError
+            self.__event.clear()
+            await self.__event.wait()
+
+        frame, self.__frame = self.__frame, None
+        self.delivered += 1
+        return frame
+
+    def stop(self):
+        super().stop()
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+        self.track.stop()
+
+    # ожидание момента выдачи следующего кадра с целевой частотой
+    async def __pace(self):
+        if not self.fps:
+            return
+        interval = 1 / self.fps
+        now = time.monotonic()
+        if self.__next_time is not None and now < self.__next_time:
+            await asyncio.sleep(self.__next_time - now)
+            now = self.__next_time
+        # после задержки выдача не пытается "догнать" пропущенные интервалы
+        self.__next_time = max(now, (self.__next_time or now)) + interval
+
+    async def __read(self):
+        while True:
+            try:
+                frame = await self.track.recv()
+            except MediaStreamError:
+                self.__ended = True
+                self.__event.set()
+                return
+
+            if self.__frame is not None:
+                self.dropped += 1
+                if self.dropped % 100 == 0:
+                    logger.debug(f"Capture: {self.dropped} frames dropped, {self.delivered} delivered")
+                if isinstance(frame, Packet):
+                    self.__wait_keyframe = True
+            if isinstance(frame, Packet) and self.__wait_keyframe:
+                if not frame.is_keyframe:
+                    self.dropped += 1
+                    self.__frame = None
+                    continue
+                self.__wait_keyframe = False
+            self.__frame = frame
+            self.__event.set()
@@ -1,6 +1,19 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import sys
+import threading
+import time
 
+LOG_FORMATS = ("color", "json")
 
+
+# Вывод в терминал с цветным уровнем сообщения; запись не изменяется,
+# поэтому остальные обработчики получают исходный levelname
 class ColorHandler(logging.StreamHandler):
     COLOR = {
         "DEBUG": "\x1b[34m",     # blue
@@ -10,10 +23,180 @@ class ColorHandler(logging.StreamHandler):
         "CRITICAL": "\x1b[31m",  # red
     }
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, stream=None):
+        super().__init__(stream)
         self.setFormatter(logging.Formatter(fmt="%(levelname)s [%(name)s]: %(message)s"))
 
-    def emit(self, record):
-        record.levelname = ColorHandler.COLOR[record.levelname] + record.levelname + '\x1b[0m'
-        super().emit(record)
+    def format(self, record):
+        colored = logging.makeLogRecord(record.__dict__)
+        if record.levelname in ColorHandler.COLOR:
+            colored.levelname = ColorHandler.COLOR[record.levelname] + record.levelname + '\x1b[0m'
+        if getattr(record, "suppressed", 0):
+            colored.msg = f"{record.getMessage()} ({record.suppressed} similar messages suppressed)"
+            colored.args = None
+        return super().format(colored)
+
+
+# Формат для машинной обработки: одна JSON-запись на строку
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Ограничение частоты сообщений с одного места в коде (файл и строка): не больше rate
+# сообщений в секунду с запасом burst. Частые сообщения (на каждый кадр или пакет)
+# прореживаются, число пропущенных передается в поле suppressed следующего сообщения.
+# Ограничиваются только сообщения не выше max_level, предупреждения и ошибки проходят всегда
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=10.0, burst=20, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate or record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.__lock:
+            tokens, updated, suppressed = self.__buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.__buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self.__buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+# Общий конвейер логов: обработчики модулей только ставят записи в очередь,
+# а форматирование и вывод выполняются в фоновом потоке. При переполнении очереди
+# записи отбрасываются, чтобы вывод логов никогда не задерживал цикл событий
+class LogPipeline:
+    def __init__(self, queue_size=10000):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.__listener = None
+        self.__lock = threading.RLock()
+        self.__handlers = [ColorHandler()]
+
+    # fmt - "color" (терминал) или "json"; filename - файл для вывода вместо stderr
+    def configure(self, fmt="color", filename=None):
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format {fmt}: use one of {', '.join(LOG_FORMATS)}")
+        stream = open(filename, "a", encoding="utf-8") if filename else sys.stderr
+        if fmt == "json":
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler = ColorHandler(stream)
+        with self.__lock:
+            restart = self.__listener is not None
+            if restart:
+                self.stop()
+            self.__handlers = [handler]
+            if restart:
+                self.start()
+
+    def start(self):
+        with self.__lock:
+            if self.__listener is None:
+                self.__listener = logging.handlers.QueueListener(self.queue, *self.__handlers)
+                self.__listener.start()
+
+    # вывод оставшихся записей и остановка фонового потока
+    def stop(self):
+        with self.__lock:
+            if self.__listener is not None:
+                self.__listener.stop()
+                self.__listener = None
+                for handler in self.__handlers:
+                    handler.flush()
+
+    # фоновый поток не переходит в процесс, созданный через fork (рабочие процессы
+    # сигнального сервера), поэтому в нем конвейер создается заново
+    def _after_fork(self):
+        running = self.__listener is not None
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.__listener = None
+        self.__lock = threading.RLock()
+        if running:
+            self.start()
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pipeline._after_fork)
+# процессы multiprocessing, созданные через fork, завершаются без atexit
+multiprocessing.util.register_after_fork(
+    pipeline, lambda obj: multiprocessing.util.Finalize(obj, obj.stop, exitpriority=0))
+
+
+# Обработчик логов модулей: сообщение форматируется в строку в месте вызова
+# (аргументы могут измениться позже), остальное выполняется в потоке конвейера
+class LogHandler(logging.handlers.QueueHandler):
+    def __init__(self, rate=10.0, burst=20):
+        super().__init__(pipeline.queue)
+        self.addFilter(RateLimitFilter(rate, burst))
+        pipeline.start()
+
+    # текст исключения сохраняется отдельно в exc_text, а не в тексте сообщения,
+    # чтобы обработчики конвейера (в том числе JSON) выводили его в своем формате
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        pipeline.put(record)
+
+
+# логгеры, подключенные к конвейеру, с их текущими уровнями
+def pipeline_loggers():
+    loggers = {}
+    for name, item in logging.root.manager.loggerDict.items():
+        if isinstance(item, logging.Logger) and any(isinstance(h, LogHandler) for h in item.handlers):
+            loggers[name] = logging.getLevelName(item.level)
+    return loggers
+
+
+# изменение уровня логгера name (или всех логгеров конвейера) во время работы
+def set_log_level(level, name=None):
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {level}")
+    names = [name] if name else list(pipeline_loggers())
+    for logger_name in names:
+        if logger_name not in logging.root.manager.loggerDict:
+            raise KeyError(logger_name)
+        logging.getLogger(logger_name).setLevel(level)
+    return names
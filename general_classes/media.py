@@ -0,0 +1,282 @@
+import asyncio
+import av
+import fractions
+import io
+import logging
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from general_classes.logging_setting import LogHandler
+
+
+# настройка логов
+logger = logging.getLogger("media")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_TIME_BASE = fractions.Fraction(1, AUDIO_SAMPLE_RATE)
+AAC_FRAME_SIZE = 1024
+AUDIO_BITRATE = "128k"
+
+# закодированный пакет, не привязанный к конкретному контейнеру,
+# поэтому один и тот же пакет можно записать в несколько получателей
+EncodedPacket = namedtuple('EncodedPacket', ['kind', 'data', 'pts', 'dts', 'is_keyframe', 'time_base'])
+
+
+# перевод битрейта вида "1800k" / "2M" в число бит в секунду
+def parse_bitrate(bitrate):
+    if not bitrate:
+        return None
+    bitrate = str(bitrate).strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(bitrate[-1])
+    if multiplier:
+        return int(float(bitrate[:-1]) * multiplier)
+    return int(bitrate)
+
+
+# определение формата контейнера по адресу получателя
+def guess_format(url):
+    scheme = url.split("://", 1)[0].lower() if "://" in url else "file"
+    if scheme in ("rtmp", "rtmps"):
+        return "flv"
+    if scheme in ("udp", "tcp", "srt"):
+        return "mpegts"
+    # для файлов формат определяется по расширению
+    return None
+
+
+# Класс для однократного кодирования дорожки, пакеты затем раздаются всем получателям
+# bitrate - битрейт дорожки, для звука по умолчанию AUDIO_BITRATE
+# shared - кадры приходят из общего источника (MediaRelay) и читаются другими потребителями,
+# поэтому кодируется копия кадра, а исходный кадр не изменяется
+class StreamEncoder:
+    def __init__(self, kind, bitrate=None, framerate=30, shared=True):
+        self.kind = kind
+        self.shared = shared
+        self.ready = False
+        # контейнер-заготовка никогда не записывается: он нужен, чтобы кодек формировал глобальные
+        # заголовки (extradata), которые затем копируются в потоки всех получателей
+        self.__container = av.open(io.BytesIO(), mode="w", format="flv")
+        self.__last_pts = None
+        self.__first_pts = None
+        self.__start_time = time.time()
+        if kind == "video":
+            self.stream = self.__container.add_stream("libx264", rate=framerate)
+            self.stream.pix_fmt = "yuv420p"
+            self.stream.codec_context.time_base = VIDEO_TIME_BASE
+            self.stream.codec_context.gop_size = framerate * 2
+            self.stream.codec_context.options = {"preset": "veryfast", "tune": "zerolatency"}
+        else:
+            self.stream = self.__container.add_stream("aac", rate=AUDIO_SAMPLE_RATE)
+            self.__resampler = av.AudioResampler(format="fltp", layout="stereo", rate=AUDIO_SAMPLE_RATE)
+            self.__fifo = av.AudioFifo()
+            self.__samples = 0
+        bit_rate = parse_bitrate(bitrate or (AUDIO_BITRATE if kind == "audio" else None))
+        if bit_rate:
+            self.stream.codec_context.bit_rate = bit_rate
+
+    # кодирование кадра (выполняется в отдельном потоке), frame=None сбрасывает буфер кодека
+    # pts и time_base задают время кадра вместо его собственных меток
+    def encode(self, frame, pts=None, time_base=None):
+        if frame is None:
+            frames = [None]
+        elif self.kind == "video":
+            frames = [self.__prepare_video(frame, pts, time_base)]
+        else:
+            frames = self.__prepare_audio(frame)
+
+        packets = []
+        for frame in frames:
+            for packet in self.stream.encode(frame):
+                packets.append(EncodedPacket(
+                    self.kind, bytes(packet), packet.pts, packet.dts, packet.is_keyframe,
+                    self.stream.codec_context.time_base
+                ))
+        if packets:
+            self.ready = True
+        return packets
+
+    def __prepare_video(self, frame, pts=None, time_base=None):
+        # размер кадра определяется камерой, а не запрошенным разрешением
+        if not self.ready:
+            self.stream.width = frame.width
+            self.stream.height = frame.height
+        if pts is None:
+            pts, time_base = frame.pts, frame.time_base
+        if pts is None or time_base is None:
+            pts = int((time.time() - self.__start_time) * VIDEO_CLOCK_RATE)
+        else:
+            pts = int(pts * time_base * VIDEO_CLOCK_RATE)
+        if self.__first_pts is None:
+            self.__first_pts = pts
+        pts -= self.__first_pts
+        # временные метки должны строго возрастать
+        if self.__last_pts is not None and pts <= self.__last_pts:
+            pts = self.__last_pts + 1
+        self.__last_pts = pts
+        if self.shared:
+            frame = self.__copy_video(frame)
+        frame.pts = pts
+        frame.time_base = VIDEO_TIME_BASE
+        frame.pict_type = av.video.frame.PictureType.NONE
+        return frame
+
+    # копия кадра для кодирования: reformat возвращает новый кадр только при смене формата,
+    # иначе данные копируются явно
+    @staticmethod
+    def __copy_video(frame):
+        copy = frame.reformat(format="yuv420p")
+        if copy is frame:
+            copy = av.VideoFrame.from_ndarray(frame.to_ndarray(format="yuv420p"), format="yuv420p")
+        return copy
+
+    def __prepare_audio(self, frame):
+        frame.pts = None
+        frame = self.__resampler.resample(frame)
+        if frame is not None:
+            self.__fifo.write(frame)
+        frames = []
+        while self.__fifo.samples >= AAC_FRAME_SIZE:
+            frame = self.__fifo.read(AAC_FRAME_SIZE)
+            frame.pts = self.__samples
+            frame.time_base = AUDIO_TIME_BASE
+            self.__samples += frame.samples
+            frames.append(frame)
+        return frames
+
+
+# Класс получателя закодированного потока (RTMP/RTMPS/UDP/файл)
+# у каждого получателя свой ограниченный буфер, свой поток записи и собственное переподключение,
+# поэтому недоступный получатель не задерживает остальных
+# timeout - время (в секундах), после которого зависшее подключение или запись считаются ошибкой
+class StreamSink:
+    def __init__(self, url, buffer_size=256, reconnect_delay=1, max_reconnect_delay=30, timeout=10):
+        self.url = url
+        self.format = guess_format(url)
+        self.timeout = timeout
+        self.dropped = 0
+        self.__queue = asyncio.Queue(maxsize=buffer_size)
+        self.__wait_keyframe = True
+        self.__reconnect_delay = reconnect_delay
+        self.__max_reconnect_delay = max_reconnect_delay
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self.__task = None
+
+    def start(self, streams):
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.__run(streams))
+
+    # постановка пакета в очередь, никогда не блокирует вызывающего
+    def put(self, packet: EncodedPacket):
+        if self.__wait_keyframe:
+            if packet.kind != "video" or not packet.is_keyframe:
+                self.dropped += 1
+                return
+            self.__wait_keyframe = False
+        try:
+            self.__queue.put_nowait(packet)
+        except asyncio.QueueFull:
+            # получатель не успевает: буфер сбрасывается и запись продолжится со следующего ключевого кадра
+            self.dropped += self.__queue.qsize() + 1
+            logger.warning(f"Sink {self.url}: buffer overflow, {self.dropped} packets dropped")
+            self.__reset()
+
+    async def close(self):
+        if self.__task:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        self.__executor.shutdown(wait=False)
+
+    def __reset(self):
+        while not self.__queue.empty():
+            self.__queue.get_nowait()
+        self.__wait_keyframe = True
+
+    async def __run(self, streams):
+        delay = self.__reconnect_delay
+        while True:
+            container = None
+            try:
+                container, outputs = await self.__call(self.__open, streams)
+                logger.info(f"Sink {self.url} connected")
+                delay = self.__reconnect_delay
+                offset = None
+                while True:
+                    packet = await self.__queue.get()
+                    # отсчет времени в каждом подключении начинается с нуля
+                    if offset is None:
+                        offset = packet.pts * packet.time_base
+                    await self.__call(self.__mux, container, outputs, packet, offset)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"Sink {self.url} stalled for {self.timeout} s")
+                # контейнер остается у зависшего потока, закрывать его из другого потока нельзя
+                container = None
+            except (av.AVError, OSError) as e:
+                logger.warning(f"Sink {self.url} failed: {e}")
+            except Exception:
+                logger.exception(f"Sink {self.url} failed")
+            finally:
+                if container:
+                    await self.__close_container(container)
+            self.__reset()
+            logger.info(f"Sink {self.url}: reconnect in {delay} s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.__max_reconnect_delay)
+
+    # выполнение операции в потоке записи с ограничением времени: если поток завис
+    # в сетевом вызове, он оставляется, а следующие операции выполняются в новом потоке
+    async def __call(self, func, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self.__executor, func, *args), self.timeout)
+        except asyncio.TimeoutError:
+            self.__executor.shutdown(wait=False)
+            self.__executor = ThreadPoolExecutor(max_workers=1)
+            raise
+
+    async def __close_container(self, container):
+        try:
+            await self.__call(self.__close, container)
+        except asyncio.TimeoutError:
+            logger.warning(f"Sink {self.url}: closing timed out")
+
+    def __open(self, streams):
+        options = {}
+        if "://" in self.url:
+            # таймаут сетевых операций FFmpeg (в микросекундах)
+            options["rw_timeout"] = str(int(self.timeout * 1000000))
+        container = av.open(self.url, mode="w", format=self.format, options=options)
+        try:
+            outputs = {kind: container.add_stream(template=stream) for kind, stream in streams.items()}
+        except Exception:
+            container.close()
+            raise
+        return container, outputs
+
+    @staticmethod
+    def __mux(container, outputs, packet, offset):
+        shift = round(offset / packet.time_base)
+        av_packet = av.Packet(packet.data)
+        av_packet.stream = outputs[packet.kind]
+        av_packet.time_base = packet.time_base
+        av_packet.pts = packet.pts - shift
+        av_packet.dts = packet.dts - shift if packet.dts is not None else None
+        av_packet.is_keyframe = packet.is_keyframe
+        container.mux(av_packet)
+
+    @staticmethod
+    def __close(container):
+        try:
+            container.close()
+        except (av.AVError, OSError) as e:
+            logger.debug(f"Closing {container.name} failed: {e}")
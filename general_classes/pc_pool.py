@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from aiortc import RTCPeerConnection
+from general_classes.logging_setting import LogHandler
+
+
+# настройка логов
+logger = logging.getLogger("pc_pool")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+
+# Класс пула заранее созданных RTCPeerConnection.
+# У каждого соединения уже добавлен трансивер и собраны ICE-кандидаты (host и server-reflexive),
+# поэтому answer/offer формируется без ожидания STUN-запросов. Собранные кандидаты привязаны
+# к сокетам соединения, поэтому кэшируются вместе с ним и считаются действительными ttl секунд:
+# по истечении этого времени NAT-привязка может устареть, и соединение пересоздается.
+# Пул пополняется одной фоновой задачей, поэтому наплыв зрителей не вызывает одновременного сбора
+# кандидатов для многих соединений.
+class PeerConnectionPool:
+    def __init__(self, size=2, ttl=60, configuration=None, kind="video", direction="sendonly"):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__configuration = configuration
+        self.__kind = kind
+        self.__direction = direction
+        self.__pool = deque()
+        self.__wakeup = asyncio.Event()
+        self.__task = None
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.__run())
+
+    # получение соединения: подготовленного из пула или нового, если пул пуст
+    async def acquire(self):
+        self.start()
+        pc = None
+        while self.__pool:
+            candidate, created = self.__pool.popleft()
+            if self.__is_fresh(candidate, created):
+                pc = candidate
+                break
+            await candidate.close()
+        self.__wakeup.set()
+        if pc:
+            self.hits += 1
+            return pc
+        # пул еще не успел заполниться: кандидаты будут собраны при setLocalDescription
+        self.misses += 1
+        logger.debug("Pool is empty, creating a peer connection on demand")
+        return self.__create()
+
+    async def close(self):
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+        pool, self.__pool = self.__pool, deque()
+        await asyncio.gather(*[pc.close() for pc, _ in pool])
+
+    def __is_fresh(self, pc, created):
+        return time.monotonic() - created < self.ttl and pc.connectionState == "new"
+
+    def __create(self):
+        pc = RTCPeerConnection(self.__configuration)
+        pc.addTransceiver(self.__kind, direction=self.__direction)
+        return pc
+
+    async def __run(self):
+        while True:
+            # удаление устаревших соединений
+            while self.__pool and not self.__is_fresh(*self.__pool[0]):
+                pc, _ = self.__pool.popleft()
+                await pc.close()
+            # пополнение пула по одному соединению
+            while len(self.__pool) < self.size:
+                pc = self.__create()
+                try:
+                    for transceiver in pc.getTransceivers():
+                        await transceiver.sender.transport.transport.iceGatherer.gather()
+                except Exception as e:
+                    logger.warning(f"ICE candidates gathering failed: {e}")
+                    await pc.close()
+                    await asyncio.sleep(self.ttl / 10)
+                    continue
+                self.__pool.append((pc, time.monotonic()))
+                logger.debug(f"Peer connection prepared, pool size {len(self.__pool)}")
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), timeout=self.ttl / 2)
+            except asyncio.TimeoutError:
+                pass
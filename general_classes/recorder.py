@@ -0,0 +1,256 @@
+import asyncio
+import av
+import logging
+import os
+import queue
+import threading
+import time
+
+from aiortc.mediastreams import MediaStreamError
+from general_classes.logging_setting import LogHandler
+from general_classes.media import EncodedPacket, StreamEncoder
+from general_classes.timestamps import RTP_TIME_BASE, SegmentIndex
+
+
+# настройка логов
+logger = logging.getLogger("recorder")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+FSYNC_POLICIES = ("none", "segment")
+
+
+# перевод длительности вида "hh:mm:ss" или числа секунд в секунды
+def parse_duration(value):
+    seconds = 0
+    for part in str(value).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+# Поток записи сегментов: пакеты из ограниченной очереди записываются пачками через
+# файловый буфер большого размера, поэтому медленный носитель (SD-карта, NFS) задерживает
+# только этот поток, но не цикл событий с сигнализацией, HTTP и живой трансляцией
+# рядом с каждым сегментом записывается индекс кадров (см. SegmentIndex),
+# wallclock - функция перевода времени видео в реальное время
+class SegmentWriter(threading.Thread):
+    def __init__(self, pattern, segment_time, format="matroska", buffer_size=512, fsync="segment",
+                 write_buffer=4 * 2 ** 20, batch_size=64):
+        super().__init__(name="SegmentWriter", daemon=True)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}: use one of {', '.join(FSYNC_POLICIES)}")
+        self.pattern = pattern
+        self.segment_time = segment_time
+        self.format = format
+        self.fsync = fsync
+        self.dropped = 0
+        self.wallclock = None
+        self.__queue = queue.Queue(maxsize=buffer_size)
+        self.__write_buffer = write_buffer
+        self.__batch_size = batch_size
+        self.__wait_keyframe = True
+        self.__streams = None
+        self.__container = None
+        self.__file = None
+        self.__index = None
+        self.__outputs = None
+        self.__segment_start = None
+        # статистика
+        self.__max_depth = 0
+        self.__batches = 0
+        self.__write_time = 0.0
+        self.__max_write_time = 0.0
+        self.__bytes = 0
+
+    def start(self, streams=None):
+        self.__streams = streams
+        super().start()
+
+    # постановка пакета в очередь, никогда не блокирует цикл событий
+    def put(self, packet: EncodedPacket):
+        if self.__wait_keyframe:
+            if packet.kind != "video" or not packet.is_keyframe:
+                self.dropped += 1
+                return
+            self.__wait_keyframe = False
+        try:
+            self.__queue.put_nowait(packet)
+        except queue.Full:
+            # носитель не успевает: пакеты отбрасываются до следующего ключевого кадра
+            self.dropped += 1
+            self.__wait_keyframe = True
+            logger.warning(f"Write queue is full, {self.dropped} packets dropped")
+        self.__max_depth = max(self.__max_depth, self.__queue.qsize())
+
+    # завершение записи: оставшиеся в очереди пакеты записываются, сегмент закрывается
+    def close(self):
+        if self.is_alive():
+            self.__queue.put(None)
+            self.join()
+
+    def stats(self):
+        return {
+            "queue_depth": self.__queue.qsize(),
+            "max_queue_depth": self.__max_depth,
+            "dropped": self.dropped,
+            "batches": self.__batches,
+            "avg_write_ms": round(1000 * self.__write_time / self.__batches, 2) if self.__batches else 0.0,
+            "max_write_ms": round(1000 * self.__max_write_time, 2),
+            "bytes": self.__bytes,
+        }
+
+    def run(self):
+        finished = False
+        while not finished:
+            batch = [self.__queue.get()]
+            while len(batch) < self.__batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                finished = True
+
+            started = time.perf_counter()
+            for packet in batch:
+                try:
+                    self.__write(packet)
+                except (av.AVError, OSError) as e:
+                    logger.error(f"Writing segment failed: {e}")
+                    self.__close_segment()
+            elapsed = time.perf_counter() - started
+            if batch:
+                self.__batches += 1
+                self.__write_time += elapsed
+                self.__max_write_time = max(self.__max_write_time, elapsed)
+        self.__close_segment()
+
+    def __write(self, packet):
+        packet_time = packet.pts * packet.time_base
+        # новый сегмент начинается с ключевого кадра по истечении segment_time
+        if packet.kind == "video" and packet.is_keyframe and (
+                self.__container is None or packet_time - self.__segment_start >= self.segment_time):
+            self.__close_segment()
+            self.__open_segment(packet_time)
+        if self.__container is None:
+            return
+
+        shift = round(self.__segment_start / packet.time_base)
+        av_packet = av.Packet(packet.data)
+        av_packet.stream = self.__outputs[packet.kind]
+        av_packet.time_base = packet.time_base
+        av_packet.pts = packet.pts - shift
+        av_packet.dts = packet.dts - shift if packet.dts is not None else None
+        av_packet.is_keyframe = packet.is_keyframe
+        self.__container.mux(av_packet)
+        self.__bytes += len(packet.data)
+
+        if packet.kind == "video":
+            # позиция берется после записи пакета: на ключевом кадре мультиплексор уже сбросил
+            # в файл предыдущий кластер, поэтому она указывает на начало кластера этого кадра
+            # (или более раннего кластера, если пакет ждет аудио для перемежения, см. SegmentIndex)
+            self.__index.add(
+                packet_time - self.__segment_start,
+                self.wallclock(packet_time) if self.wallclock else None,
+                packet.is_keyframe,
+                self.__file.tell()
+            )
+
+    def __open_segment(self, segment_start):
+        filename = time.strftime(self.pattern)
+        file = open(filename, "wb", buffering=self.__write_buffer)
+        container = None
+        try:
+            container = av.open(file, mode="w", format=self.format)
+            outputs = {kind: container.add_stream(template=stream) for kind, stream in self.__streams.items()}
+            index = SegmentIndex(filename)
+        except Exception:
+            # недосозданный сегмент закрывается, чтобы не оставлять открытый файл
+            if container is not None:
+                try:
+                    container.close()
+                except (av.AVError, OSError):
+                    pass
+            file.close()
+            raise
+        self.__file = file
+        self.__container = container
+        self.__outputs = outputs
+        self.__index = index
+        self.__segment_start = segment_start
+        logger.info(f"Segment {filename} opened")
+
+    def __close_segment(self):
+        if self.__container is None:
+            return
+        name = self.__file.name
+        try:
+            self.__container.close()
+            self.__file.flush()
+            if self.fsync == "segment":
+                os.fsync(self.__file.fileno())
+        except (av.AVError, OSError) as e:
+            logger.error(f"Closing segment {name} failed: {e}")
+        finally:
+            self.__file.close()
+            self.__index.close()
+            self.__container = None
+            self.__file = None
+            self.__index = None
+        logger.info(f"Segment {name} closed")
+        logger.debug(f"Writer stats: {self.stats()}")
+
+
+# Класс для записи дорожек в сегменты: кадры кодируются вне цикла событий,
+# а пакеты передаются в SegmentWriter, который пишет их в отдельном потоке
+class SegmentRecorder:
+    def __init__(self, pattern, segment_time, format="matroska", buffer_size=512, fsync="segment"):
+        self.writer = SegmentWriter(pattern, parse_duration(segment_time), format, buffer_size, fsync)
+        self.__encoders = {}
+        self.__clocks = {}
+        self.__tasks = []
+        self.__started = False
+        self.__stopped = False
+
+    # clock - WallClock для вычисления временных меток кадров дорожки (по умолчанию метки кадров)
+    def addTrack(self, track, clock=None):
+        self.__encoders[track] = StreamEncoder(track.kind)
+        if clock:
+            self.__clocks[track] = clock
+            if track.kind == "video":
+                self.writer.wallclock = clock.wallclock
+
+    async def start(self):
+        if self.__tasks or self.__stopped:
+            return
+        for track, encoder in self.__encoders.items():
+            self.__tasks.append(asyncio.ensure_future(self.__run_track(track, encoder, self.__clocks.get(track))))
+
+    async def stop(self):
+        if self.__stopped:
+            return
+        self.__stopped = True
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
+        # кодировщик настроен без задержки кадров (zerolatency), поэтому сбрасывать его не нужно
+        await asyncio.get_event_loop().run_in_executor(None, self.writer.close)
+        logger.info(f"Recorder stats: {self.writer.stats()}")
+
+    async def __run_track(self, track, encoder, clock=None):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                return
+            # время кадра передается кодировщику отдельно, общий кадр не изменяется
+            pts = clock.timestamp(frame) if clock else None
+            packets = await loop.run_in_executor(None, encoder.encode, frame, pts, RTP_TIME_BASE if clock else None)
+            # запись начинается, когда все кодеки сформировали заголовки
+            if not self.__started and all(e.ready for e in self.__encoders.values()):
+                self.__started = True
+                self.writer.start({e.kind: e.stream for e in self.__encoders.values()})
+            for packet in packets:
+                self.writer.put(packet)
@@ -5,14 +5,14 @@ import websockets
 
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
-from general_classes.logging_setting import ColorHandler
+from general_classes.logging_setting import LogHandler
 from websockets import WebSocketServerProtocol
 
 
 # настройка логов
 logger = logging.getLogger("socket")
 logger.setLevel(logging.INFO)
-logger.addHandler(ColorHandler())
+logger.addHandler(LogHandler())
 
 
 # базовый класс для дальнейшего наследования
@@ -0,0 +1,154 @@
+import bisect
+import csv
+import fractions
+import logging
+import os
+import time
+
+from general_classes.logging_setting import LogHandler
+
+
+# настройка логов
+logger = logging.getLogger("timestamps")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+RTP_CLOCK_RATE = 90000
+RTP_TIME_BASE = fractions.Fraction(1, RTP_CLOCK_RATE)
+RTP_WRAP = 2 ** 32
+INDEX_SUFFIX = ".idx"
+INDEX_FIELDS = ["frame", "pts", "wallclock", "keyframe", "offset"]
+
+
+# Временные метки записи по реальному времени с переменной частотой кадров.
+# PTS вычисляется по RTP-меткам кадров (с учетом переполнения 32-битного счетчика), поэтому
+# при падении частоты кадров запись не расходится с реальным временем. Соответствие RTP-времени
+# и времени прихода кадров (offset) сглаживается экспоненциально, чтобы сетевой джиттер не влиял на метки.
+# Разрыв определяется по отклонению времени прихода от сглаженного соответствия, а не по шагу
+# между соседними кадрами: кадры, задержанные сетью и пришедшие пачкой, сохраняют RTP-время.
+# Если RTP-время опережает время прихода больше чем на gap секунд или отстает от него дольше gap секунд
+# (перезапуск отправителя, сброс счетчика), отсчет продолжается по времени прихода.
+# Кадры приходят из общего MediaRelay, поэтому сами кадры не изменяются: вычисленный PTS
+# передается кодировщику отдельно (см. SegmentRecorder.addTrack)
+class WallClock:
+    def __init__(self, gap=1.0, smoothing=0.02):
+        self.gap = gap
+        self.smoothing = smoothing
+        self.gaps = 0
+        self.__last_rtp = None
+        self.__last_arrival = None
+        self.__media_time = 0.0
+        self.__offset = None
+        self.__late_since = None
+        self.__last_pts = None
+
+    # PTS кадра в единицах RTP_TIME_BASE; arrival - время прихода кадра (по умолчанию текущее)
+    def timestamp(self, frame, arrival=None):
+        arrival = time.time() if arrival is None else arrival
+        rtp = frame.pts if frame.pts is not None and frame.time_base == RTP_TIME_BASE else None
+
+        if self.__last_arrival is None:
+            media_time = 0.0
+        elif rtp is None or self.__last_rtp is None:
+            media_time = self.__media_time + arrival - self.__last_arrival
+        else:
+            delta = ((rtp - self.__last_rtp) % RTP_WRAP) / RTP_CLOCK_RATE
+            # переполнение назад означает переупорядочивание или сброс счетчика
+            media_time = self.__media_time + delta if delta <= RTP_WRAP / RTP_CLOCK_RATE / 2 else None
+
+        if media_time is not None and self.__offset is not None:
+            # отклонение времени прихода от ожидаемого по RTP-времени
+            drift = arrival - (self.__offset + media_time)
+            if drift < -self.gap:
+                media_time = None
+            elif drift > self.gap:
+                # задержанные кадры: пачка после задержки сети быстро возвращается к ожидаемому времени,
+                # а долгое отставание означает разрыв RTP-времени
+                if self.__late_since is None:
+                    self.__late_since = arrival
+                elif arrival - self.__late_since > self.gap:
+                    media_time = None
+            else:
+                self.__late_since = None
+
+        if media_time is None:
+            self.gaps += 1
+            logger.warning("Timestamp gap: RTP time does not match arrival time, resynchronized")
+            media_time = arrival - self.__offset
+            self.__late_since = None
+        elif media_time - self.__media_time > self.gap:
+            logger.info(f"{media_time - self.__media_time:.3f} s without frames")
+        self.__media_time = media_time
+
+        # сглаживание разницы между временем прихода и временем кадра, задержанные кадры не учитываются
+        offset = arrival - media_time
+        if self.__offset is None:
+            self.__offset = offset
+        elif self.__late_since is None:
+            self.__offset += (offset - self.__offset) * self.smoothing
+
+        pts = round(media_time * RTP_CLOCK_RATE)
+        if self.__last_pts is not None and pts <= self.__last_pts:
+            pts = self.__last_pts + 1
+        self.__last_pts = pts
+        self.__last_rtp = rtp
+        self.__last_arrival = arrival
+        return pts
+
+    # реальное время (unix time) кадра с временем time_position (в секундах от начала дорожки)
+    def wallclock(self, time_position):
+        if self.__offset is None:
+            return None
+        return self.__offset + float(time_position)
+
+
+# Запись индекса сегмента: для каждого кадра его номер, PTS в секундах от начала сегмента,
+# реальное время и для ключевых кадров - позиция в файле после записи кадра. Мультиплексор
+# сбрасывает в файл только завершенные кластеры, поэтому позиция - начало кластера с ключевым кадром
+# или (если пакет ждет перемежения с аудио) одного из предыдущих кластеров, но не дальше ключевого кадра.
+# Индекс сбрасывается на диск на каждом ключевом кадре, чтобы по нему можно было читать записываемый сегмент
+class SegmentIndex:
+    def __init__(self, segment_name):
+        self.__file = open(segment_name + INDEX_SUFFIX, "w", newline="", encoding="utf-8")
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(INDEX_FIELDS)
+        self.__frame = 0
+
+    def add(self, pts, wallclock, keyframe, offset):
+        self.__writer.writerow([
+            self.__frame,
+            f"{float(pts):.6f}",
+            f"{wallclock:.6f}" if wallclock is not None else "",
+            int(keyframe),
+            offset if keyframe else "",
+        ])
+        self.__frame += 1
+        if keyframe:
+            self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+# ключевые кадры сегмента по индексу: список (pts, offset) в порядке записи,
+# пустой, если индекса нет; недописанная последняя строка записываемого сегмента пропускается
+def read_keyframes(segment_name):
+    index_name = segment_name + INDEX_SUFFIX
+    if not os.path.exists(index_name):
+        return []
+    keyframes = []
+    with open(index_name, newline="", encoding="utf-8") as index_file:
+        for row in csv.DictReader(index_file):
+            if row.get("keyframe") != "1":
+                continue
+            try:
+                keyframes.append((float(row["pts"]), int(row["offset"])))
+            except (TypeError, ValueError):
+                continue
+    return keyframes
+
+
+# ключевые кадры не позже позиции position (в секундах), начиная с ближайшего к ней
+def keyframes_before(keyframes, position):
+    i = bisect.bisect_right([pts for pts, _ in keyframes], position)
+    return keyframes[i - 1::-1] if i else []
@@ -4,38 +4,34 @@ import logging
 import ssl
 import sys
 
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, MediaStreamTrack
-from aiortc.contrib.media import MediaRecorder, MediaRelay
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
+from aiortc.contrib.media import MediaRelay
 from argparse import ArgumentParser
-from general_classes.logging_setting import ColorHandler
+from client import WebRTCClient
+from general_classes.logging_setting import LogHandler, LOG_FORMATS, pipeline
+from general_classes.recorder import SegmentRecorder
 from general_classes.signaling import WebSocketServer, WebSocketClient
+from general_classes.timestamps import WallClock
 from web_server.webserver import WebServer
 
 
-# исправление pts-presentation timestamp в видео на равномерный,
-# чтобы избежить проблем при кодировании
-class FixedPtsTrack(MediaStreamTrack):
-    kind = "video"
-
-    def __init__(self, track):
-        super().__init__()
-        self.track = track
-        self.pts = 0
-
-    async def recv(self):
-        frame = await self.track.recv()
-        frame.pts = self.pts
-        self.pts += 6122
-        return frame
+logger = logging.getLogger("webrtc")
 
 
 # Класс для создания webRTC подключения
+# relays - список вышестоящих серверов (host, port), которым ретранслируется принятое видео
+# queue_size - длина очереди пакетов записи на диск
 class WebRTCServer:
-    def __init__(self):
+    def __init__(self, relays=(), fsync="segment", queue_size=512):
         self.pc = None
         self.signaling = None
         self.recorder = None
         self.__video = None
+        self.__relay = MediaRelay()
+        self.__relays = list(relays)
+        self.__uplinks = []
+        self.__fsync = fsync
+        self.__queue_size = queue_size
 
     async def accept(self, port, segment_time, server=None, turn=None):
         ice_servers = [RTCIceServer('stun:stun.l.google.com:19302')]
@@ -48,14 +44,9 @@ class WebRTCServer:
         else:
             self.signaling = WebSocketServer(port)
 
-        recorder_options = {
-            "segment_time": segment_time,
-            "reset_timestamps": "1",
-            "strftime": "1",
-        }
-        self.recorder = MediaRecorder('video/%Y-%m-%d_%H-%M-%S.mkv',
-                                      format="segment",
-                                      options=recorder_options)
+        # запись ведется в отдельном потоке, чтобы медленный носитель не блокировал цикл событий
+        self.recorder = SegmentRecorder('video/%Y-%m-%d_%H-%M-%S.mkv', segment_time,
+                                        buffer_size=self.__queue_size, fsync=self.__fsync)
 
         async def send_answer():
             logger.debug(f"Ice Gathering State: {self.pc.iceGatheringState}")
@@ -96,22 +87,41 @@ class WebRTCServer:
                 self.recorder.addTrack(track)
             elif track.kind == "video":
                 self.__video = track
-                self.recorder.addTrack(FixedPtsTrack(MediaRelay().subscribe(track)))
+                # временные метки по RTP и времени прихода кадров, чтобы запись не расходилась с реальным временем
+                self.recorder.addTrack(self.__relay.subscribe(track), WallClock())
+                await self.__start_relays(turn)
             logger.info(f"Track {track.kind} added")
 
             @track.on("ended")
             async def on_ended():
                 await self.recorder.stop()
+                await self.__stop_relays()
                 logger.info(f"Track {track.kind} ended")
 
+    # ретрансляция принятого видео на вышестоящие серверы: сервер выступает для них издателем,
+    # поэтому камера отправляет один поток, а зрителей обслуживают узлы каскада
+    async def __start_relays(self, turn=None):
+        await self.__stop_relays()
+        for host, port in self.__relays:
+            uplink = WebRTCClient(track=self.__relay.subscribe(self.__video))
+            await uplink.connect(host, port, turn)
+            self.__uplinks.append(uplink)
+            logger.info(f"Relay to {host}:{port} started")
+
+    async def __stop_relays(self):
+        uplinks, self.__uplinks = self.__uplinks, []
+        for uplink in uplinks:
+            await uplink.close_connection()
+
     async def close_connection(self):
+        await self.__stop_relays()
         await self.recorder.stop()
         await self.signaling.close()
         await self.pc.close()
 
     async def video_track(self):
         if self.__video:
-            return MediaRelay().subscribe(self.__video)
+            return self.__relay.subscribe(self.__video)
         else:
             return None
 
@@ -146,10 +156,15 @@ def main():
     parser = ArgumentParser()
     parser.add_argument("-p", "--port", type=int, help='Server port (default: 443)')
     parser.add_argument("-v", "--verbose", action="count", help='Enable debug log')
+    parser.add_argument("--log-format", choices=LOG_FORMATS, help="Log output format (default: color)")
+    parser.add_argument("--log-file", help="Write log to the file instead of the terminal")
     parser.add_argument("-st", "--segment", help="Set the duration of one fragment of the video file")
+    parser.add_argument("--fsync", choices=["none", "segment"], help="Sync segments to disk on close (default: segment)")
     parser.add_argument("-c", "--configuration", action="count", help="Create config file")
     parser.add_argument("-w", "--enableeweb", action="count", help="Enable web server")
     parser.add_argument("-s", "--server", help="Signaling server IP address")
+    parser.add_argument("--relay", action="append", default=[],
+                        help="Upstream signaling server HOST:PORT to re-publish the video to (can be repeated)")
     parser.add_argument("--cert-file", help="SSL certificate file (for HTTPS)")
     parser.add_argument("--key-file", help="SSL key file (for HTTPS)")
     args = parser.parse_args()
@@ -165,12 +180,30 @@ def main():
         args.port = config.get("CONNECTION", "Port", fallback="443")
     if not args.segment:
         args.segment = config.get("RECORDER", "Segment", fallback="00:30:00")
+    if not args.fsync:
+        args.fsync = config.get("RECORDER", "fsync", fallback="segment")
+    queue_size = config.getint("RECORDER", "queue_size", fallback=512)
+    session_key = config.get("WEB", "session_key", fallback=None)
     if args.verbose or config.get("LOG", "enable_debug", fallback="false").lower() == "true":
         logger.setLevel(logging.DEBUG)
+    if not args.log_format:
+        args.log_format = config.get("LOG", "format", fallback="color")
+    if not args.log_file:
+        args.log_file = config.get("LOG", "file", fallback=None)
+    pipeline.configure(args.log_format, args.log_file)
     if not args.enableeweb:
         args.enableeweb = config.get("CONNECTION", "enable_webserver", fallback="false").lower() == "true"
     if not args.server:
         args.server = config.get("CONNECTION", "signaling_server", fallback=None)
+    if not args.relay:
+        args.relay = config.get("RELAY", "servers", fallback="").split()
+    relays = []
+    for relay in args.relay:
+        host, _, relay_port = relay.rpartition(":")
+        if not host or not relay_port.isdigit():
+            logger.error(f"Invalid relay server {relay}: use HOST:PORT format")
+            sys.exit(1)
+        relays.append((host, int(relay_port)))
 
     turn_server = None
     if config.has_option("TURN", "url"):
@@ -188,8 +221,8 @@ def main():
         ssl_context = None
 
     # Создание WebRTC и Web сервера
-    conn = WebRTCServer()
-    web_server = WebServer(conn.video_track, ssl_context)
+    conn = WebRTCServer(relays, args.fsync, queue_size)
+    web_server = WebServer(conn.video_track, ssl_context, session_key=session_key)
 
     try:
         # запуск всех задач
@@ -207,7 +240,6 @@ def main():
 
 if __name__ == '__main__':
     # Настройка логов
-    logger = logging.getLogger("webrtc")
     logger.setLevel(logging.INFO)
-    logger.addHandler(ColorHandler())
+    logger.addHandler(LogHandler())
     main()
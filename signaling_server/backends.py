@@ -0,0 +1,275 @@
+import asyncio
+import base64
+import json
+import logging
+import uuid
+
+from collections import deque
+from urllib.parse import urlparse
+
+from general_classes.logging_setting import LogHandler
+
+
+# настройка логов
+logger = logging.getLogger("signaling_backend")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+
+# Базовый класс механизма обмена сообщениями между процессами сигнального сервера.
+# Хранит ограниченный буфер последних сообщений каждой комнаты и рассылает сообщения
+# остальным процессам; собственные сообщения процессу не возвращаются.
+class PubSubBackend:
+    def __init__(self, history_size=100):
+        self.history_size = history_size
+        self.worker_id = uuid.uuid4().hex
+        self._deliver = None
+
+    # deliver(room, message) вызывается для сообщений других процессов
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def publish(self, room, message):
+        raise NotImplementedError
+
+    async def history(self, room):
+        raise NotImplementedError
+
+    async def clear(self, room):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# Общая шина для LocalBackend: состояние комнат внутри одного процесса
+class LocalBus:
+    def __init__(self):
+        self.histories = {}
+        self.backends = set()
+
+
+# Механизм обмена внутри процесса. Несколько серверов с общей шиной LocalBus ведут себя
+# как независимые процессы с общим состоянием, что позволяет проверять работу без Redis
+class LocalBackend(PubSubBackend):
+    def __init__(self, history_size=100, bus=None):
+        super().__init__(history_size)
+        self.bus = bus or LocalBus()
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self.bus.backends.add(self)
+
+    async def publish(self, room, message):
+        history = self.bus.histories.setdefault(room, deque(maxlen=self.history_size))
+        history.append(message)
+        receivers = [backend for backend in self.bus.backends if backend is not self]
+        for backend in receivers:
+            await backend._deliver(room, message)
+
+    async def history(self, room):
+        return list(self.bus.histories.get(room, ()))
+
+    async def clear(self, room):
+        self.bus.histories.pop(room, None)
+
+    async def close(self):
+        self.bus.backends.discard(self)
+
+
+# Минимальное подключение к Redis-совместимому серверу по протоколу RESP
+class RedisConnection:
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        self.__lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, url):
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        connection = cls(reader, writer)
+        if parsed.password:
+            await connection.execute("AUTH", parsed.password)
+        if parsed.path.strip("/"):
+            await connection.execute("SELECT", parsed.path.strip("/"))
+        return connection
+
+    async def execute(self, *args):
+        async with self.__lock:
+            self.send(*args)
+            return await self.read()
+
+    # отправка нескольких команд за один обмен с сервером
+    async def pipeline(self, *commands):
+        async with self.__lock:
+            for command in commands:
+                self.send(*command)
+            replies, error = [], None
+            for _ in commands:
+                try:
+                    replies.append(await self.read())
+                except RuntimeError as e:
+                    error = error or e
+                    replies.append(None)
+            if error:
+                raise error
+            return replies
+
+    def send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.__writer.write(b"".join(parts))
+
+    async def read(self):
+        line = await self.__reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {payload.decode()}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.__reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self.read() for _ in range(length)]
+        raise RuntimeError(f"Unknown Redis reply: {line!r}")
+
+    async def close(self):
+        self.__writer.close()
+        await self.__writer.wait_closed()
+
+
+# Механизм обмена через Redis (или совместимый сервер): буфер комнаты хранится в списке
+# signaling:history:<room>, сообщения рассылаются через канал signaling:messages
+class RedisBackend(PubSubBackend):
+    CHANNEL = "signaling:messages"
+
+    def __init__(self, url="redis://localhost:6379", history_size=100, reconnect_delay=1, max_reconnect_delay=30):
+        super().__init__(history_size)
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.__commands = None
+        self.__subscriber = None
+        self.__task = None
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self.__commands = await RedisConnection.open(self.url)
+        self.__subscriber = await self.__subscribe()
+        self.__task = asyncio.ensure_future(self.__listen())
+        logger.info(f"Connected to {self.url}")
+
+    async def publish(self, room, message):
+        key = self.__key(room)
+        data = self.__encode(message)
+        envelope = json.dumps({"worker": self.worker_id, "room": room, "message": data})
+        await self.__command("pipeline", (
+            ("RPUSH", key, data),
+            ("LTRIM", key, -self.history_size, -1),
+            ("PUBLISH", self.CHANNEL, envelope),
+        ))
+
+    async def history(self, room):
+        items = await self.__command("execute", ("LRANGE", self.__key(room), 0, -1))
+        return [self.__decode(item.decode()) for item in items or []]
+
+    async def clear(self, room):
+        await self.__command("execute", ("DEL", self.__key(room)))
+
+    async def close(self):
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+        for connection in (self.__commands, self.__subscriber):
+            await self.__close_connection(connection)
+
+    # выполнение команды с однократным переподключением при разрыве соединения
+    async def __command(self, method, args):
+        try:
+            return await getattr(self.__commands, method)(*args)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Redis connection lost: {e}, reconnecting")
+            await self.__close_connection(self.__commands)
+            self.__commands = await RedisConnection.open(self.url)
+            return await getattr(self.__commands, method)(*args)
+
+    async def __subscribe(self):
+        connection = await RedisConnection.open(self.url)
+        try:
+            await connection.execute("SUBSCRIBE", self.CHANNEL)
+        except Exception:
+            await self.__close_connection(connection)
+            raise
+        return connection
+
+    # чтение сообщений других процессов; при разрыве соединения подписка восстанавливается,
+    # иначе процесс продолжал бы принимать клиентов, не получая сообщений остальных процессов
+    async def __listen(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if self.__subscriber is None:
+                    self.__subscriber = await self.__subscribe()
+                    logger.info(f"Resubscribed to {self.url}")
+                    delay = self.reconnect_delay
+                reply = await self.__subscriber.read()
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, OSError, RuntimeError, asyncio.IncompleteReadError) as e:
+                logger.warning(f"Redis subscription failed: {e}, reconnect in {delay} s")
+                await self.__close_connection(self.__subscriber)
+                self.__subscriber = None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            if not isinstance(reply, list) or len(reply) != 3 or reply[0] != b"message":
+                continue
+            try:
+                envelope = json.loads(reply[2])
+                if envelope["worker"] != self.worker_id:
+                    await self._deliver(envelope["room"], self.__decode(envelope["message"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Invalid message from Redis")
+
+    @staticmethod
+    async def __close_connection(connection):
+        if connection is None:
+            return
+        try:
+            await connection.close()
+        except (ConnectionError, OSError):
+            pass
+
+    @staticmethod
+    def __key(room):
+        return f"signaling:history:{room}"
+
+    # текстовые сообщения хранятся как есть, бинарные - в base64 с префиксом
+    @staticmethod
+    def __encode(message):
+        if isinstance(message, bytes):
+            return "b:" + base64.b64encode(message).decode()
+        return "t:" + message
+
+    @staticmethod
+    def __decode(data):
+        if data.startswith("b:"):
+            return base64.b64decode(data[2:])
+        return data[2:]
@@ -1,6 +1,9 @@
 import asyncio
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import sys
 import websockets
 
 from argparse import ArgumentParser
@@ -8,25 +11,42 @@ from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from websockets.exceptions import ConnectionClosedOK
 
-from general_classes.logging_setting import ColorHandler
+from general_classes.logging_setting import LogHandler
+from backends import LocalBackend, RedisBackend
 from websockets import WebSocketServerProtocol
 
 # настройка логов
 logger = logging.getLogger("signaling_server")
 logger.setLevel(logging.INFO)
-logger.addHandler(ColorHandler())
+logger.addHandler(LogHandler())
 
 
+# Сигнальный сервер: клиенты с одинаковым путем подключения (комнатой) обмениваются сообщениями.
+# Состояние комнат и рассылка между процессами выполняются через backend (см. backends.py),
+# поэтому сервер может работать в нескольких процессах или на нескольких узлах
 class WebSocketSignalingServer:
-    def __init__(self, port):
-        # список подключенных клиентов
-        self.clients = set()
-        # список сообщений
-        self.prev_messages = []
-        start_server = websockets.serve(self.__handler, '0.0.0.0', port)
-        asyncio.ensure_future(start_server)
-
-    async def __handler(self, websock: WebSocketServerProtocol, _):
+    def __init__(self, port, backend=None, reuse_port=False):
+        # подключенные к этому процессу клиенты по комнатам
+        self.rooms = {}
+        self.backend = backend or LocalBackend()
+        self.port = port
+        self.reuse_port = reuse_port
+        self.__server = None
+
+    # подключение к backend и открытие порта; ошибки (например, недоступный Redis) передаются вызывающему
+    async def start(self):
+        await self.backend.start(self.__deliver)
+        options = {"reuse_port": True} if self.reuse_port else {}
+        self.__server = await websockets.serve(self.__handler, '0.0.0.0', self.port, **options)
+        logger.info(f"Listening on port {self.port}")
+
+    # рассылка сообщения клиентам комнаты этого процесса
+    async def __deliver(self, room, message, sender=None):
+        receivers = self.rooms.get(room, set()) - {sender}
+        if receivers:
+            await asyncio.wait([asyncio.create_task(client.send(message)) for client in receivers])
+
+    async def __handler(self, websock: WebSocketServerProtocol, path):
         logger.info(f"Connected {websock.remote_address} websockets")
         # авторизация
         # генерация случайной последовательности длиной 128 байт
@@ -56,44 +76,101 @@ class WebSocketSignalingServer:
             return
         # авторизация успешна, прололжение
         logger.info(f"Authentication succeed: {websock.remote_address}")
-        self.clients.add(websock)
-        # если до подключения клиента на сервер были переданы какие-то сообщения, то они посылаются ему
-        if self.prev_messages:
-            await asyncio.wait([asyncio.create_task(websock.send(message)) for message in self.prev_messages])
+        room = path or "/"
         try:
+            self.rooms.setdefault(room, set()).add(websock)
+            # если до подключения клиента в комнату были переданы какие-то сообщения, то они посылаются ему
+            prev_messages = await self.backend.history(room)
+            if prev_messages:
+                await asyncio.wait([asyncio.create_task(websock.send(message)) for message in prev_messages])
             # чтение сообщений от клиента
             async for message in websock:
-                self.prev_messages.append(message)
-                # отправка полученного сообщения всем кроме отправителя
-                receivers = (self.clients - {websock})
-                if receivers:
-                    await asyncio.wait([asyncio.create_task(client.send(message)) for client in receivers])
+                # отправка полученного сообщения всем кроме отправителя: в других процессах через backend
+                await self.backend.publish(room, message)
+                await self.__deliver(room, message, websock)
         finally:
-            # удаление клиента из списка при его отключении и очистка сохраненных сообщений
-            self.clients.discard(websock)
-            self.prev_messages.clear()
+            # удаление клиента из комнаты при его отключении и очистка сохраненных сообщений
+            clients = self.rooms.get(room, set())
+            clients.discard(websock)
+            if not clients:
+                self.rooms.pop(room, None)
+            await self.backend.clear(room)
 
     async def close(self):
-        if self.clients:
-            await asyncio.wait([asyncio.create_task(client.close()) for client in self.clients])
+        if self.__server:
+            self.__server.close()
+        clients = set().union(*self.rooms.values())
+        if clients:
+            await asyncio.wait([asyncio.create_task(client.close()) for client in clients])
+        await self.backend.close()
+
+
+def run_worker(args):
+    if args.backend == "redis":
+        backend = RedisBackend(args.redis_url, args.history)
+    else:
+        backend = LocalBackend(args.history)
+    server = WebSocketSignalingServer(args.port, backend, reuse_port=args.workers > 1)
+    loop = asyncio.get_event_loop()
+
+    try:
+        loop.run_until_complete(server.start())
+    except Exception as e:
+        # процесс без открытого порта завершается с ошибкой, чтобы это было видно родительскому процессу
+        logger.error(f"Worker failed to start: {e}")
+        loop.run_until_complete(server.close())
+        sys.exit(1)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
 
 
 def main():
     parser = ArgumentParser()
     parser.add_argument("-p", "--port", type=int, help='Server port (default: 8080)')
+    parser.add_argument("-w", "--workers", type=int, default=1, help='Number of worker processes (default: 1)')
+    parser.add_argument("-b", "--backend", choices=["local", "redis"], default="local",
+                        help='Room state backend (default: local)')
+    parser.add_argument("--redis-url", help='Redis-compatible server url (default: redis://localhost:6379)')
+    parser.add_argument("--history", type=int, default=100, help='Messages kept per room (default: 100)')
     args = parser.parse_args()
 
     if not args.port:
         args.port = os.getenv("PORT", default=8080)
+    if not args.redis_url:
+        args.redis_url = os.getenv("REDIS_URL", default="redis://localhost:6379")
+    if args.workers > 1 and args.backend == "local":
+        logger.error("Several workers need a shared backend: use --backend redis")
+        sys.exit(1)
 
-    server = WebSocketSignalingServer(args.port)
+    if args.workers == 1:
+        run_worker(args)
+        return
 
+    # процессы принимают подключения на общем порту (SO_REUSEPORT) и обмениваются сообщениями через redis
+    workers = [multiprocessing.Process(target=run_worker, args=(args,)) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
     try:
-        asyncio.get_event_loop().run_forever()
+        # при аварийном завершении одного процесса остальные останавливаются
+        running = list(workers)
+        while running:
+            multiprocessing.connection.wait([worker.sentinel for worker in running])
+            failed = [worker for worker in running if worker.exitcode not in (None, 0)]
+            running = [worker for worker in running if worker.exitcode is None]
+            if failed:
+                logger.error(f"Worker exited with code {failed[0].exitcode}, stopping the server")
+                for worker in running:
+                    worker.terminate()
+                    worker.join()
+                sys.exit(1)
     except KeyboardInterrupt:
-        pass
-    finally:
-        asyncio.get_event_loop().run_until_complete(server.close())
+        for worker in workers:
+            worker.join()
 
 
 if __name__ == '__main__':
@@ -1,17 +1,18 @@
-from aiortc.contrib.media import MediaPlayer, MediaRelay, MediaRecorder
+from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import MediaStreamError
+from argparse import ArgumentParser
+from general_classes.logging_setting import LogHandler, LOG_FORMATS, pipeline
+from general_classes.media import StreamEncoder, StreamSink
 import asyncio
+import configparser
+import logging
 import platform
 import sys
 
 
-def get_tracks():
-    video_options = {"video_size": "1280x720", "vcodec": "h264", "b:v": "1800k"}
-    audio_options = {"acodec": "libmp3lame", "b:a": "128k", "ar": "44100"}
-    audio_track = MediaPlayer(
-                        "anullsrc=channel_layout=stereo:sample_rate=44100",
-                        format='lavfi',
-                        options=audio_options
-                    ).audio
+def get_tracks(resolution="1280x720"):
+    video_options = {"video_size": resolution, "framerate": "30"}
+    audio_track = MediaPlayer("anullsrc=channel_layout=stereo:sample_rate=44100", format='lavfi').audio
 
     if platform.system() == "Windows":
         video_track = MediaPlayer(
@@ -25,17 +26,106 @@ def get_tracks():
     return audio_track, video_track
 
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        trans_key = sys.argv[1]
-    else:
-        print('The following argument is required: translation-key')
-        sys.exit()
-    relay = MediaRelay()
-    recorder = MediaRecorder(f'rtmp://a.rtmp.youtube.com/live2/{trans_key}', format='flv')
-    audio, video = get_tracks()
-    recorder.addTrack(audio)
-    recorder.addTrack(relay.subscribe(video))
+# Класс для трансляции: каждая дорожка кодируется один раз,
+# а полученные пакеты раздаются всем получателям
+class Restreamer:
+    def __init__(self, destinations, bitrate=None, buffer_size=256):
+        self.sinks = [StreamSink(url, buffer_size) for url in destinations]
+        self.__bitrate = bitrate
+        self.__encoders = {}
+        self.__tasks = []
+        self.__started = False
+
+    def addTrack(self, track):
+        # битрейт задается только для видео, звук кодируется со своим битрейтом по умолчанию
+        bitrate = self.__bitrate if track.kind == "video" else None
+        # кадры камеры читаются только этим кодировщиком, поэтому копировать их не нужно
+        self.__encoders[track] = StreamEncoder(track.kind, bitrate, shared=False)
+
+    async def start(self):
+        for track, encoder in self.__encoders.items():
+            self.__tasks.append(asyncio.ensure_future(self.__run_track(track, encoder)))
+
+    async def stop(self):
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
+        await asyncio.gather(*[sink.close() for sink in self.sinks])
+
+    async def __run_track(self, track, encoder):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                return
+            packets = await loop.run_in_executor(None, encoder.encode, frame)
+            # получатели подключаются, когда все кодеки сформировали заголовки
+            if not self.__started and all(e.ready for e in self.__encoders.values()):
+                self.__started = True
+                streams = {e.kind: e.stream for e in self.__encoders.values()}
+                for sink in self.sinks:
+                    sink.start(streams)
+            for packet in packets:
+                for sink in self.sinks:
+                    sink.put(packet)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("key", nargs="?", help="YouTube translation key")
+    parser.add_argument("-d", "--destination", action="append", default=[],
+                        help="RTMP/RTMPS/UDP url or file (can be repeated)")
+    parser.add_argument("-r", "--resolution", help="Set cam resolution")
+    parser.add_argument("-b", "--bitrate", help="Set video bitrate")
+    parser.add_argument("-v", "--verbose", action="count", help="Enable debug log")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, help="Log output format (default: color)")
+    parser.add_argument("--log-file", help="Write log to the file instead of the terminal")
+    args = parser.parse_args()
+    # Получение конфига
+    config = configparser.ConfigParser()
+    config.read('stream.ini')
+
+    destinations = args.destination
+    if args.key:
+        destinations.append(f"rtmp://a.rtmp.youtube.com/live2/{args.key}")
+    if not destinations:
+        destinations = config.get("STREAM", "destinations", fallback="").split()
+    if not destinations:
+        logger.error("Destinations not specified: use translation key, -d parameters "
+                     "or destinations option in stream.ini")
+        sys.exit(1)
+    if args.verbose or config.get("LOG", "enable_debug", fallback="false").lower() == "true":
+        logger.setLevel(logging.DEBUG)
+    if not args.log_format:
+        args.log_format = config.get("LOG", "format", fallback="color")
+    if not args.log_file:
+        args.log_file = config.get("LOG", "file", fallback=None)
+    pipeline.configure(args.log_format, args.log_file)
+    if not args.resolution:
+        args.resolution = config.get("CAM", "resolution", fallback="1280x720")
+    if not args.bitrate:
+        args.bitrate = config.get("CAM", "bitrate", fallback="1800k")
+    buffer_size = config.getint("STREAM", "buffer", fallback=256)
+
+    logger.debug(f"Destinations: {', '.join(destinations)}")
+
+    restreamer = Restreamer(destinations, args.bitrate, buffer_size)
+    audio, video = get_tracks(args.resolution)
+    restreamer.addTrack(audio)
+    restreamer.addTrack(video)
     loop = asyncio.get_event_loop()
-    loop.create_task(recorder.start())
-    loop.run_forever()
+    try:
+        loop.create_task(restreamer.start())
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(restreamer.stop())
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger("stream")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(LogHandler())
+    main()
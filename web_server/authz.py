@@ -1,25 +1,87 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp_security.abc import AbstractAuthorizationPolicy
 
+# параметры scrypt: ~16 МБ памяти и десятки миллисекунд на одну проверку
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# проверка паролей выполняется в отдельном пуле, чтобы наплыв входов не занимал
+# ни цикл событий, ни общий пул потоков, в котором кодируется видео
+_password_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="password")
+
 
 class DictionaryAuthorizationPolicy(AbstractAuthorizationPolicy):
-    def __init__(self, user_map):
+    def __init__(self, user_map, cache_size=1024):
         super().__init__()
         self.user_map = user_map
+        self.cache_size = cache_size
+        # LRU-кэш прав: identity -> frozenset(permissions)
+        self.__permissions = OrderedDict()
 
     async def authorized_userid(self, identity):
         if identity in self.user_map:
             return identity
 
     async def permits(self, identity, permission, context=None):
-        user = self.user_map.get(identity)
-        if not user:
-            return False
-        return permission in user.permissions
+        permissions = self.__permissions.get(identity)
+        if permissions is None:
+            user = self.user_map.get(identity)
+            if not user:
+                return False
+            permissions = frozenset(user.permissions)
+            self.__permissions[identity] = permissions
+            while len(self.__permissions) > self.cache_size:
+                self.__permissions.popitem(last=False)
+        self.__permissions.move_to_end(identity)
+        return permission in permissions
 
+    # сброс кэша после изменения прав пользователя
+    def invalidate(self, identity=None):
+        if identity is None:
+            self.__permissions.clear()
+        else:
+            self.__permissions.pop(identity, None)
 
-async def check_credentials(user_map, username, password):
-    user = user_map.get(username)
-    if not user:
+
+# хэш пароля с солью в формате scrypt$n$r$p$salt$hash
+def hash_password(password, salt=None):
+    salt = salt or os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return "$".join([
+        "scrypt", str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode()
+    ])
+
+
+def verify_password(password_hash, password):
+    try:
+        algorithm, n, r, p, salt, digest = password_hash.split("$")
+    except ValueError:
+        return False
+    if algorithm != "scrypt":
         return False
+    expected = base64.b64decode(digest)
+    actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p),
+                            dklen=len(expected))
+    return hmac.compare_digest(actual, expected)
+
+
+# хэш для несуществующих пользователей, чтобы время ответа не выдавало наличие логина
+_DUMMY_HASH = hash_password("")
 
-    return user.password == password
+
+async def check_credentials(user_map, username, password):
+    user = user_map.get(username)
+    password_hash = user.password if user else _DUMMY_HASH
+    verified = await asyncio.get_event_loop().run_in_executor(
+        _password_executor, verify_password, password_hash, password or ""
+    )
+    return bool(user) and verified
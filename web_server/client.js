@@ -36,7 +36,7 @@ function createPeerConnection() {
     return pc;
 }
 
-function negotiate() {
+function negotiate(url, params) {
     return pc.createOffer({ 'offerToReceiveVideo': true }).then(function(offer) {
         return pc.setLocalDescription(offer);
     }, function(error) {
@@ -59,11 +59,12 @@ function negotiate() {
         var offer = pc.localDescription;
         offer.sdp = sdpFilterCodec('video', 'VP8/90000', offer.sdp);
 
-        return fetch('/offer', {
-            body: JSON.stringify({
-                sdp: offer.sdp,
-                type: offer.type
-            }),
+        params = params || {};
+        params.sdp = offer.sdp;
+        params.type = offer.type;
+
+        return fetch(url, {
+            body: JSON.stringify(params),
             headers: {
                 'Content-Type': 'application/json'
             },
@@ -82,8 +83,19 @@ function start() {
     document.getElementById('start').href = 'javascript: stop()';
     document.getElementById('start').innerHTML = 'disconnect';
     pc = createPeerConnection()
-    dc = pc.createDataChannel('chat');
-    negotiate();
+    negotiate('/offer');
+}
+
+function replay(name) {
+    var position = parseFloat(prompt('Start position (seconds):', '0'));
+    if (isNaN(position))
+        return;
+    if (pc)
+        stop();
+    document.getElementById('start').href = 'javascript: stop()';
+    document.getElementById('start').innerHTML = 'disconnect';
+    pc = createPeerConnection()
+    negotiate('/replay/' + encodeURIComponent(name), {position: position});
 }
 
 function stop() {
@@ -100,8 +112,10 @@ function stop() {
         });
     }
 
+    var closing = pc;
+    pc = null;
     setTimeout(function() {
-        pc.close();
+        closing.close();
     }, 1000);
 }
 
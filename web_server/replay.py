@@ -0,0 +1,273 @@
+import asyncio
+import av
+import logging
+import os
+import time
+
+from aiortc import MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
+from concurrent.futures import ThreadPoolExecutor
+from general_classes.logging_setting import LogHandler
+from general_classes.timestamps import keyframes_before, read_keyframes
+
+
+# настройка логов
+logger = logging.getLogger("replay")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+MATROSKA_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+MATROSKA_CRC32_ID = 0xBF
+MATROSKA_TIMECODE_ID = 0xE7
+
+
+# чтение числа переменной длины EBML (размер элемента), None - в конце данных или при ошибке
+def read_vint(file):
+    first = file.read(1)
+    if not first:
+        return None
+    length = 1
+    while length <= 8 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        return None
+    rest = file.read(length - 1)
+    if len(rest) < length - 1:
+        return None
+    value = first[0] & (0xFF >> length)
+    for byte in rest:
+        value = (value << 8) | byte
+    return value
+
+
+# поиск кластера matroska, который начинается с ключевого кадра pts (в секундах):
+# позиция из индекса не дальше этого кластера, поэтому кластеры просматриваются от нее вперед.
+# Возвращает позицию кластера или None, если на позиции не кластер (другой формат)
+# или кластер еще не записан на диск (последний ключевой кадр записываемого сегмента)
+def find_cluster(file, offset, pts, tolerance=0.1, max_clusters=8):
+    for _ in range(max_clusters):
+        file.seek(offset)
+        if file.read(4) != MATROSKA_CLUSTER_ID:
+            return None
+        size = read_vint(file)
+        if size is None:
+            return None
+        start = file.tell()
+        element = file.read(1)
+        if element and element[0] == MATROSKA_CRC32_ID:
+            file.seek(read_vint(file) or 0, os.SEEK_CUR)
+            element = file.read(1)
+        if not element or element[0] != MATROSKA_TIMECODE_ID:
+            return None
+        length = read_vint(file)
+        value = file.read(length or 0)
+        if not length or len(value) < length:
+            return None
+        # метка кластера в миллисекундах от начала сегмента
+        timecode = int.from_bytes(value, "big") / 1000
+        if timecode > pts + tolerance:
+            return None
+        if timecode >= pts - tolerance:
+            # весь кластер должен быть на диске, иначе кадры будут обрезаны
+            return offset if start + size <= os.fstat(file.fileno()).st_size else None
+        offset = start + size
+    return None
+
+
+# Чтение записи с кластера ключевого кадра без перехода по времени: заголовок файла (все до первого
+# кластера, с описанием дорожек) и сразу за ним данные с позиции offset. Переход по времени
+# в записываемом сегменте (еще без индекса Cues) означает чтение файла с начала
+class SpliceReader:
+    def __init__(self, path, header_size, offset):
+        self.__file = open(path, "rb")
+        self.__header_size = header_size
+        self.__offset = offset
+        self.__position = 0
+
+    def read(self, size=-1):
+        if self.__position < self.__header_size:
+            remaining = self.__header_size - self.__position
+            data = self.__file.read(remaining if size < 0 else min(size, remaining))
+            self.__position += len(data)
+            if self.__position == self.__header_size:
+                self.__file.seek(self.__offset)
+            return data
+        return self.__file.read(size)
+
+    def close(self):
+        self.__file.close()
+
+
+# Дорожка воспроизведения записанного файла с заданной позиции (в секундах) в реальном времени
+# чтение и декодирование выполняются в отдельном потоке, файл открывается при первом запросе кадра
+class ReplayTrack(MediaStreamTrack):
+    kind = "video"
+
+    def __init__(self, path, position=0.0):
+        super().__init__()
+        self.path = path
+        # текущая позиция воспроизведения
+        self.position = position
+        self.__container = None
+        self.__reader = None
+        self.__frames = None
+        self.__start_time = None
+        self.__start_position = None
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        loop = asyncio.get_event_loop()
+        try:
+            frame = await loop.run_in_executor(self.__executor, self.__next_frame)
+        except (av.AVError, OSError) as e:
+            logger.warning(f"Replay of {self.path} failed: {e}")
+            frame = None
+        if frame is None:
+            self.stop()
+            raise MediaStreamError
+
+        # выдача кадров в темпе записи
+        if self.__start_time is None:
+            self.__start_time = time.time()
+            self.__start_position = frame.time
+        wait = self.__start_time + (frame.time - self.__start_position) - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.position = frame.time
+        return frame
+
+    def stop(self):
+        if self.readyState != "live":
+            return
+        super().stop()
+        self.__executor.submit(self.__close)
+        self.__executor.shutdown(wait=False)
+
+    def __next_frame(self):
+        if self.__container is None:
+            self.__open()
+        # кадры от ключевого кадра до запрошенной позиции пропускаются
+        for frame in self.__frames:
+            if frame.time is not None and frame.time >= self.position:
+                return frame
+        return None
+
+    def __open(self):
+        if self.position:
+            keyframe = self.__find_keyframe()
+            if keyframe:
+                self.__reader = SpliceReader(self.path, *keyframe)
+                self.__container = av.open(self.__reader)
+                self.__frames = self.__container.decode(self.__container.streams.video[0])
+                return
+            logger.info(f"No indexed keyframe found in {self.path}, seeking by time")
+
+        self.__container = av.open(self.path)
+        stream = self.__container.streams.video[0]
+        if self.position:
+            # переход к ближайшему предшествующему ключевому кадру без декодирования с начала файла
+            self.__container.seek(int(self.position / stream.time_base), stream=stream)
+        self.__frames = self.__container.decode(stream)
+
+    # кластер ближайшего предшествующего ключевого кадра по индексу: (размер заголовка, позиция кластера)
+    # последние ключевые кадры записываемого сегмента могут быть еще не на диске, тогда берутся предыдущие
+    def __find_keyframe(self):
+        keyframes = read_keyframes(self.path)
+        if not keyframes:
+            return None
+        with open(self.path, "rb") as file:
+            # сегмент начинается с ключевого кадра, поэтому первый кластер идет сразу за заголовком
+            header_size = keyframes[0][1]
+            file.seek(header_size)
+            if file.read(4) != MATROSKA_CLUSTER_ID:
+                return None
+            for pts, offset in keyframes_before(keyframes, self.position):
+                cluster = find_cluster(file, offset, pts)
+                if cluster is not None:
+                    return header_size, cluster
+        return None
+
+    def __close(self):
+        if self.__container:
+            self.__container.close()
+            self.__container = None
+        if self.__reader:
+            self.__reader.close()
+            self.__reader = None
+
+
+# Конвейер воспроизведения файла, общий для всех зрителей на одной позиции
+class ReplaySource:
+    def __init__(self, path, position):
+        self.track = ReplayTrack(path, position)
+        self.relay = MediaRelay()
+        self.viewers = set()
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.track.readyState == "live"
+
+
+# Класс для управления воспроизведением записей:
+# зрители одного файла, чьи позиции отличаются не более чем на tolerance секунд,
+# получают кадры от одного конвейера чтения/декодирования через MediaRelay,
+# конвейеры без зрителей закрываются через idle_timeout секунд
+class ReplayManager:
+    def __init__(self, tolerance=2.0, idle_timeout=60):
+        self.tolerance = tolerance
+        self.idle_timeout = idle_timeout
+        self.__sources = {}
+        self.__task = None
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.__evict())
+
+    # получение дорожки файла path с позиции position для нового зрителя
+    def subscribe(self, path, position=0.0):
+        sources = self.__sources.setdefault(path, [])
+        source = next((s for s in sources if s.alive and abs(s.track.position - position) <= self.tolerance), None)
+        if source is None:
+            source = ReplaySource(path, position)
+            sources.append(source)
+            logger.info(f"Replay pipeline for {path} at {position:.1f} s created")
+        track = source.relay.subscribe(source.track)
+        source.viewers.add(track)
+        source.last_used = time.monotonic()
+        return track
+
+    # отключение зрителя
+    def release(self, track):
+        track.stop()
+        for sources in self.__sources.values():
+            for source in sources:
+                if track in source.viewers:
+                    source.viewers.discard(track)
+                    source.last_used = time.monotonic()
+                    return
+
+    async def close(self):
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+        for sources in self.__sources.values():
+            for source in sources:
+                source.track.stop()
+        self.__sources.clear()
+
+    async def __evict(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            for path, sources in list(self.__sources.items()):
+                for source in list(sources):
+                    if not source.alive or (not source.viewers and now - source.last_used > self.idle_timeout):
+                        source.track.stop()
+                        sources.remove(source)
+                        logger.info(f"Replay pipeline for {path} closed")
+                if not sources:
+                    del self.__sources[path]
@@ -0,0 +1,72 @@
+import base64
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from aiohttp_session import Session
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from cryptography import fernet
+
+from general_classes.logging_setting import LogHandler
+
+# настройка логов
+logger = logging.getLogger("sessions")
+logger.setLevel(logging.INFO)
+logger.addHandler(LogHandler())
+
+
+# загрузка ключа шифрования сессий из файла или создание нового,
+# чтобы сессии пользователей сохранялись после перезапуска сервера
+def load_secret_key(path):
+    if os.path.exists(path):
+        with open(path, "rb") as key_file:
+            fernet_key = key_file.read().strip()
+    else:
+        fernet_key = fernet.Fernet.generate_key()
+        # ключ доступен только владельцу
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(fernet_key)
+        logger.info(f"Session key {path} created")
+    return base64.urlsafe_b64decode(fernet_key)
+
+
+# Хранилище сессий в зашифрованных cookie с кэшем расшифрованных сессий на сервере:
+# cookie расшифровывается один раз, повторные запросы с тем же cookie берут данные из LRU-кэша
+class CachedCookieStorage(EncryptedCookieStorage):
+    def __init__(self, secret_key, cache_size=1024, **kwargs):
+        super().__init__(secret_key, **kwargs)
+        self.cache_size = cache_size
+        self.__cache = OrderedDict()
+
+    async def load_session(self, request):
+        cookie = self.load_cookie(request)
+        data = self.__cache.get(cookie) if cookie else None
+        if data is not None:
+            if self.max_age is None or data["created"] + self.max_age >= time.time():
+                self.__cache.move_to_end(cookie)
+                return Session(None, data={"created": data["created"], "session": dict(data["session"])},
+                               new=False, max_age=self.max_age)
+            del self.__cache[cookie]
+
+        session = await super().load_session(request)
+        if cookie and not session.new:
+            self.__remember(cookie, {"created": session.created, "session": dict(session)})
+        return session
+
+    async def save_session(self, request, response, session):
+        await super().save_session(request, response, session)
+        if session.empty:
+            self.__cache.pop(self.load_cookie(request), None)
+            return
+        # сохраненный cookie сразу попадает в кэш, чтобы следующий запрос его не расшифровывал
+        cookie = response.cookies.get(self.cookie_name)
+        if cookie and cookie.value:
+            self.__remember(cookie.value, {"created": session.created, "session": dict(session)})
+
+    def __remember(self, cookie, data):
+        self.__cache[cookie] = data
+        self.__cache.move_to_end(cookie)
+        while len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
@@ -1,10 +1,24 @@
+import getpass
+import sys
+
 from collections import namedtuple
 
 User = namedtuple('User', ['username', 'password', 'permissions'])
 
+# password - хэш пароля scrypt (см. authz.hash_password), для получения хэша:
+#   python -m web_server.users
 user_map = {
     user.username: user for user in [
-        User('vadim', 'qwerty', ('realtime_video', 'download')),
-        User('admin', 'qwerty', ('realtime_video', ))
+        User('vadim', 'scrypt$16384$8$1$kn0+qMmaqnnHXJRAkp/6Qw==$6aJJ0Y2yPNAIay6ov+IWjy/OZ6jWn2HR20LZsJRvvGVsRdUJ8Gnpwvw70xCmR8tBzmNNf+8eP1uKB59Va2gvVA==',
+             ('realtime_video', 'download', 'replay')),
+        User('admin', 'scrypt$16384$8$1$xOIFMlrHNS6LAnu+z2Z1Pw==$+MflcVyINFE8vZ+o71VA25qNwRlw9A8mZGZKIzWdjISdswn3XpLmsff9fnc6S7e2aKM3UujptxglE/+336ivYg==',
+             ('realtime_video', 'logging'))
     ]
 }
+
+
+if __name__ == "__main__":
+    from web_server.authz import hash_password
+
+    password = sys.argv[1] if len(sys.argv) > 1 else getpass.getpass()
+    print(hash_password(password))
@@ -1,6 +1,5 @@
 import aiohttp_jinja2
 import asyncio
-import base64
 import jinja2
 import json
 import os
@@ -8,21 +7,35 @@ import logging
 
 from aiohttp import web
 from aiohttp_session import setup as setup_session
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
 from aiohttp_security import setup as setup_security, check_permission, check_authorized, remember, forget, \
     authorized_userid
 from aiohttp_security import SessionIdentityPolicy
-from aiortc import RTCPeerConnection, RTCSessionDescription
-from cryptography import fernet
+from aiortc import RTCSessionDescription
 
-from general_classes.logging_setting import ColorHandler
+from general_classes.logging_setting import LogHandler, pipeline, pipeline_loggers, set_log_level
+from general_classes.pc_pool import PeerConnectionPool
+from general_classes.timestamps import INDEX_SUFFIX
 from web_server.authz import DictionaryAuthorizationPolicy, check_credentials
+from web_server.replay import ReplayManager
+from web_server.sessions import CachedCookieStorage, load_secret_key
 from web_server.users import user_map
 
 # настройка логов
 logger = logging.getLogger("webapp")
 logger.setLevel(logging.INFO)
-logger.addHandler(ColorHandler())
+logger.addHandler(LogHandler())
+
+
+VIDEO_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "../video"))
+
+
+# полный путь к файлу name из папки video или None, если имя указывает за ее пределы
+# (aiohttp декодирует %2F в имени уже после сопоставления маршрута)
+def video_path(name):
+    fullname = os.path.realpath(os.path.join(VIDEO_DIRECTORY, name))
+    if os.path.dirname(fullname) != os.path.realpath(VIDEO_DIRECTORY):
+        return None
+    return fullname
 
 
 # класс для создания web-сервера
@@ -46,7 +59,7 @@ class WebServer:
             "filename": f,
             "url": f"/download/{f}",
             "size": get_size(f)
-        } for f in os.listdir(directory)]
+        } for f in os.listdir(directory) if not f.endswith(INDEX_SUFFIX)]
         return {"videos": files, "user": username}
 
     @staticmethod
@@ -64,9 +77,8 @@ class WebServer:
     @staticmethod
     async def _download_file(request):
         await check_permission(request, 'download')
-        filename = request.match_info['name']
-        fullname = os.path.join(os.path.dirname(__file__), "../video", filename)
-        if os.path.exists(fullname):
+        fullname = video_path(request.match_info['name'])
+        if fullname and os.path.isfile(fullname):
             return web.FileResponse(fullname)
         else:
             return web.Response(status=404)
@@ -100,32 +112,78 @@ class WebServer:
         await forget(request, response)
         return response
 
-    def __init__(self, get_video_fun, ssl_context=None):
+    # уровни логгеров и число отброшенных при переполнении очереди записей
+    @staticmethod
+    async def _log_levels(request):
+        await check_permission(request, 'logging')
+        return web.json_response({"loggers": pipeline_loggers(), "dropped": pipeline.dropped})
+
+    # изменение уровня логов без перезапуска: {"level": "DEBUG", "logger": "webapp"},
+    # без поля logger уровень меняется у всех логгеров
+    @staticmethod
+    async def _set_log_level(request):
+        await check_permission(request, 'logging')
+        params = await request.json()
+        try:
+            names = set_log_level(params["level"], params.get("logger"))
+        except (KeyError, ValueError, TypeError):
+            return web.Response(status=400)
+        logger.info(f"Log level {params['level']} set for {', '.join(names)} by {request.remote}")
+        return web.json_response({"loggers": pipeline_loggers(), "dropped": pipeline.dropped})
+
+    # session_key - файл ключа шифрования сессий (создается при первом запуске)
+    def __init__(self, get_video_fun, ssl_context=None, port=8080, pc_pool_size=2, session_key=None):
         self._ssl_context = ssl_context
+        self._port = port
+        self._session_key = session_key or os.path.join(os.path.dirname(__file__), "session.key")
         self._pcs = set()
+        # заранее подготовленные подключения для быстрого ответа зрителям
+        self._pc_pool = PeerConnectionPool(size=pc_pool_size)
         self._get_video_fun = get_video_fun
+        self._replay = ReplayManager()
         self._server = None
 
     # обработка запроса offer и отправка answer
     async def _offer(self, request):
         await check_permission(request, 'realtime_video')
         params = await request.json()
+        track = await self._get_video_fun()
+        return await self._answer(request, params, track, track.stop if track else None)
+
+    # обработка post запросов вида /replay/name
+    # name - имя файла из папки video для воспроизведения, position - позиция начала в секундах
+    async def _replay_file(self, request):
+        await check_permission(request, 'replay')
+        fullname = video_path(request.match_info['name'])
+        if not fullname or not os.path.isfile(fullname):
+            return web.Response(status=404)
+        params = await request.json()
+        try:
+            position = max(0.0, float(params.get("position", 0)))
+        except (TypeError, ValueError):
+            return web.Response(status=400)
+        track = self._replay.subscribe(fullname, position)
+        return await self._answer(request, params, track, lambda: self._replay.release(track))
+
+    # создание подключения для отправки дорожки track и формирование answer
+    # on_close вызывается при разрыве подключения
+    async def _answer(self, request, params, track, on_close=None):
         offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
-        pc = RTCPeerConnection()
+        pc = await self._pc_pool.acquire()
         self._pcs.add(pc)
 
         logger.info(f"Created for {request.remote}")
-        track = await self._get_video_fun()
 
         @pc.on("connectionstatechange")
         async def on_connectionstatechange():
             logger.info(f"Connection state: {pc.connectionState}")
             # закрытие подлючения
-            if pc.connectionState == "failed":
-                await pc.close()
-                track.stop()
+            if pc.connectionState in ("failed", "closed") and pc in self._pcs:
                 self._pcs.discard(pc)
+                await pc.close()
+                if on_close:
+                    on_close()
 
         await pc.setRemoteDescription(offer)
         if track:
@@ -144,7 +202,7 @@ class WebServer:
     async def _on_shutdown(self, _):
         # закрыть все подключения
         task = [pc.close() for pc in self._pcs]
-        await asyncio.gather(*task)
+        await asyncio.gather(self._pc_pool.close(), self._replay.close(), *task)
         self._pcs.clear()
 
     async def start_webserver(self):
@@ -152,10 +210,9 @@ class WebServer:
         app.on_shutdown.append(self._on_shutdown)
         # настройка авторизации
         app.user_map = user_map
-        fernet_key = fernet.Fernet.generate_key()
-        secret_key = base64.urlsafe_b64decode(fernet_key)
+        secret_key = load_secret_key(self._session_key)
 
-        storage = EncryptedCookieStorage(secret_key, cookie_name='API_SESSION')
+        storage = CachedCookieStorage(secret_key, cookie_name='API_SESSION')
         setup_session(app, storage)
 
         policy = SessionIdentityPolicy()
@@ -169,13 +226,18 @@ class WebServer:
         app.router.add_post("/login", WebServer._login)
         app.router.add_get("/logout", WebServer._logout)
         app.router.add_post("/offer", self._offer)
+        app.router.add_post("/replay/{name}", self._replay_file)
         app.router.add_get("/download/{name}", WebServer._download_file)
+        app.router.add_get("/log", WebServer._log_levels)
+        app.router.add_post("/log", WebServer._set_log_level)
         aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(os.path.dirname(__file__)))
         # запуск веб-сервера
         runner = web.AppRunner(app)
         await runner.setup()
-        self._server = web.TCPSite(runner, host="0.0.0.0", port=8080, ssl_context=self._ssl_context)
+        self._server = web.TCPSite(runner, host="0.0.0.0", port=self._port, ssl_context=self._ssl_context)
         await self._server.start()
+        self._pc_pool.start()
+        self._replay.start()
 
     async def stop_webserver(self):
         if self._server: